@@ -0,0 +1,323 @@
+# FUM Benchmark Script
+# Source: https://github.com/zeittresor/sd-forge-fum
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import types
+import weakref
+
+import torch # pip install torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib_fum import backbone, schedule, spectral
+from lib_fum.patch import Fourier_filter, patch_FUM_v2
+
+# Runs the FUM hot path without Forge: a stub UNet patcher takes the output block patch from
+# patch_FUM_v2 and the suites feed it the features one UNet call produces.
+#   patch            whole output block patch per UNet call (latency, throughput, peak memory)
+#   filter           Fourier_filter per skip connection shape and backend
+#   backbone-memory  extra memory of the backbone scaling kernels
+# Results can be printed as a table, JSON or JSON lines (one record per configuration) to compare
+# releases, ex. python fum_benchmark.py --suite patch --format jsonl >> bench.jsonl
+
+
+# (model, model_channels, channel_mult, latent size); every level has 3 output blocks
+unet_configs = [
+    ("SD1.5", 320, (1, 2, 4, 4), 64),
+    ("SD2.1", 320, (1, 2, 4, 4), 96),
+    ("SDXL", 320, (1, 2, 4), 128),
+]
+
+# (model, resolution, h shape) of the output blocks FUM patches; batch 2 = cond + uncond
+backbone_shapes = [
+    ("SD1.5", "512", (2, 1280, 16, 16)),
+    ("SD1.5", "512", (2, 640, 32, 32)),
+    ("SDXL", "1024", (2, 1280, 32, 32)),
+    ("SDXL", "1024", (2, 640, 64, 64)),
+    ("SDXL", "2048 hires", (2, 1280, 64, 64)),
+    ("SDXL", "2048 hires", (2, 640, 128, 128)),
+]
+
+default_scales = (1.01, 1.02, 0.99, 0.95)
+
+
+class StubUnetPatcher:
+    # The parts of Forge's UnetPatcher that patch_FUM_v2 touches.
+    def __init__(self, model_channels, model=None):
+        if model is None:
+            model = types.SimpleNamespace(diffusion_model=types.SimpleNamespace(config={"model_channels": model_channels}))
+        self.model = model
+        self.output_block_patches = []
+
+    def clone(self):
+        clone = StubUnetPatcher(None, self.model)
+        clone.output_block_patches = list(self.output_block_patches)
+        return clone
+
+    def set_model_output_block_patch(self, patch):
+        self.output_block_patches.append(patch)
+
+
+class PeakMemory(TorchDispatchMode):
+    # CPU stand-in for the CUDA allocator peak: counts the storages created while active until the
+    # last tensor using them is gone. Storages of the given tensors are not counted.
+    def __init__(self, *tensors):
+        super().__init__()
+        self.current = 0
+        self.peak = 0
+        self.storages = {}
+        for t in tensors:
+            self.storages[t.untyped_storage().data_ptr()] = [0, 1]
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        for t in tree_flatten(out)[0]:
+            if isinstance(t, torch.Tensor):
+                self.track(t)
+        return out
+
+    def track(self, t):
+        key = t.untyped_storage().data_ptr()
+        entry = self.storages.get(key)
+        if entry is None:
+            entry = [t.untyped_storage().nbytes(), 0]
+            self.storages[key] = entry
+            self.current += entry[0]
+            self.peak = max(self.peak, self.current)
+        entry[1] += 1
+        weakref.finalize(t, self.release, key)
+
+    def release(self, key):
+        entry = self.storages.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            self.current -= entry[0]
+            del self.storages[key]
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+def measure_peak(fn, device, *inputs):
+    if device.type == "cuda":
+        synchronize(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        baseline = torch.cuda.memory_allocated(device)
+        fn()
+        synchronize(device)
+        return torch.cuda.max_memory_allocated(device) - baseline
+
+    with PeakMemory(*inputs) as tracker:
+        fn()
+    return tracker.peak
+
+
+def measure_latency(fn, device, iterations, warmup, setup=None):
+    for _ in range(warmup):
+        if setup is not None:
+            setup()
+        fn()
+
+    timings = []
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        synchronize(device)
+        start = time.perf_counter()
+        fn()
+        synchronize(device)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def latency_stats(timings):
+    timings = sorted(timings)
+    return {
+        "latency_ms_median": statistics.median(timings) * 1000.0,
+        "latency_ms_p90": timings[min(len(timings) - 1, int(round(0.9 * (len(timings) - 1))))] * 1000.0,
+        "latency_ms_min": timings[0] * 1000.0,
+    }
+
+
+def unet_blocks(model_channels, channel_mult, latent, batch_size):
+    # h shapes of the output blocks of one UNet call, deepest level first like the UNet runs them.
+    shapes = []
+    for level in reversed(range(len(channel_mult))):
+        size = latent // 2 ** level
+        shapes += [(batch_size, model_channels * channel_mult[level], size, size)] * 3
+    return shapes
+
+
+def patch_suite(device, dtype, iterations, warmup, kernels, backends, batch_size, scales):
+    results = []
+    for model, model_channels, channel_mult, latent in unet_configs:
+        shapes = unet_blocks(model_channels, channel_mult, latent, batch_size)
+        features = [(torch.randn(shape, device=device, dtype=dtype), torch.randn(shape, device=device, dtype=dtype)) for shape in shapes]
+        working = [(h.clone(), hsp.clone()) for h, hsp in features]
+
+        for kernel in kernels:
+            for backend in backends:
+                unet = patch_FUM_v2(StubUnetPatcher(model_channels), *scales, filter_backend=backend, backbone_kernel=kernel)
+                patches = unet.output_block_patches
+                schedule.progress.reset()
+
+                def reset_features():
+                    for (h, hsp), (h0, hsp0) in zip(working, features):
+                        h.copy_(h0)
+                        hsp.copy_(hsp0)
+
+                def unet_call():
+                    for h, hsp in working:
+                        for patch in patches:
+                            h, hsp = patch(h, hsp, {})
+
+                timings = measure_latency(unet_call, device, iterations, warmup, reset_features)
+                reset_features()
+                peak = measure_peak(unet_call, device, *[t for pair in working for t in pair])
+                stats = latency_stats(timings)
+                mean = statistics.fmean(timings)
+                results.append({
+                    "suite": "patch",
+                    "model": model,
+                    "latent": latent,
+                    "batch_size": batch_size,
+                    "blocks": len(shapes),
+                    "patched_blocks": sum(1 for shape in shapes if shape[1] in (model_channels * 4, model_channels * 2)),
+                    "kernel": kernel,
+                    "backend": backend,
+                    **stats,
+                    "unet_calls_per_s": 1.0 / mean,
+                    "latents_per_s": batch_size / mean,
+                    "peak_bytes": peak,
+                })
+    return results
+
+
+def filter_suite(device, dtype, iterations, warmup, backends, batch_size, scales):
+    results = []
+    for model, model_channels, channel_mult, latent in unet_configs:
+        skip_shapes = sorted({
+            shape for shape in unet_blocks(model_channels, channel_mult, latent, batch_size)
+            if shape[1] in (model_channels * 4, model_channels * 2)
+        }, key=lambda shape: (-shape[1], shape[2]))
+
+        for shape in skip_shapes:
+            hsp = torch.randn(shape, device=device, dtype=dtype)
+            scale = scales[2] if shape[1] == model_channels * 4 else scales[3]
+            for backend in backends:
+                resolved = spectral.resolve_backend(shape[-2], shape[-1], 1, backend)
+                run = lambda: Fourier_filter(hsp, threshold=1, scale=scale, backend=backend)
+                timings = measure_latency(run, device, iterations, warmup)
+                results.append({
+                    "suite": "filter",
+                    "model": model,
+                    "latent": latent,
+                    "shape": list(shape),
+                    "backend": backend,
+                    "resolved_backend": resolved,
+                    **latency_stats(timings),
+                    "filters_per_s": 1.0 / statistics.fmean(timings),
+                    "peak_bytes": measure_peak(run, device, hsp),
+                })
+    return results
+
+
+def backbone_memory_suite(device, dtype, kernels):
+    results = []
+    for model, resolution, shape in backbone_shapes:
+        for kernel in kernels:
+            h = torch.randn(shape, device=device, dtype=dtype)
+            scale = torch.tensor([1.1, 1.2], device=device, dtype=dtype).view(-1, 1, 1, 1)
+            # first call outside the measurement, so fused kernels are built already
+            backbone.kernels.run(kernel, h.clone(), scale)
+            peak = measure_peak(lambda: backbone.kernels.run(kernel, h, scale), device, h)
+            results.append({
+                "suite": "backbone-memory",
+                "model": model,
+                "resolution": resolution,
+                "shape": list(shape),
+                "kernel": kernel,
+                "feature_bytes": h.numel() * h.element_size(),
+                "peak_bytes": peak,
+            })
+    return results
+
+
+def environment(device, dtype):
+    return {
+        "torch": torch.__version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "device": str(device),
+        "device_name": torch.cuda.get_device_name(device) if device.type == "cuda" else platform.processor(),
+        "dtype": str(dtype).replace("torch.", ""),
+        "threads": torch.get_num_threads(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def print_table(results):
+    for r in results:
+        if r["suite"] == "patch":
+            name = f"patch {r['model']} latent {r['latent']} {r['kernel']}/{r['backend']}"
+            print(f"{name:<48} {r['latency_ms_median']:>9.3f} ms {r['unet_calls_per_s']:>9.1f} calls/s {r['peak_bytes'] / 2 ** 20:>9.2f} MiB")
+        elif r["suite"] == "filter":
+            shape = "x".join(str(x) for x in r["shape"])
+            name = f"filter {r['model']} {shape} {r['backend']}->{r['resolved_backend']}"
+            print(f"{name:<48} {r['latency_ms_median']:>9.3f} ms {r['filters_per_s']:>9.1f} call/s  {r['peak_bytes'] / 2 ** 20:>9.2f} MiB")
+        else:
+            shape = "x".join(str(x) for x in r["shape"])
+            name = f"backbone {r['model']} {r['resolution']} {shape} {r['kernel']}"
+            ratio = r["peak_bytes"] / r["feature_bytes"]
+            print(f"{name:<48} {r['peak_bytes'] / 2 ** 20:>9.2f} MiB {ratio:>9.3f} x feature")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Microbenchmarks for the FUM output block patch')
+    parser.add_argument('--suite', type=str, nargs='+', default=['patch', 'filter', 'backbone-memory'], choices=['patch', 'filter', 'backbone-memory'], help='Suites to run (default: all)')
+    parser.add_argument('--device', type=str, default='cpu', help='Device to run on (default: cpu)')
+    parser.add_argument('--dtype', type=str, default='float32', choices=['float16', 'bfloat16', 'float32'], help='Feature dtype (default: float32)')
+    parser.add_argument('--batch_size', type=int, default=2, help='Latent batch per UNet call, cond + uncond (default: 2)')
+    parser.add_argument('--iterations', type=int, default=20, help='Timed iterations per configuration (default: 20)')
+    parser.add_argument('--warmup', type=int, default=3, help='Untimed iterations before timing (default: 3)')
+    parser.add_argument('--kernels', type=str, nargs='+', default=['eager', 'low_memory'], choices=list(backbone.backbone_kernels), help='Backbone kernels to compare (default: eager low_memory)')
+    parser.add_argument('--backends', type=str, nargs='+', default=['auto'], choices=list(spectral.filter_backends), help='Skip filter backends to compare (default: auto)')
+    parser.add_argument('--scales', type=float, nargs=4, default=default_scales, metavar=('B1', 'B2', 'S1', 'S2'), help='FUM scales (default: 1.01 1.02 0.99 0.95)')
+    parser.add_argument('--format', type=str, default='table', choices=['table', 'json', 'jsonl'], help='Output format (default: table)')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    dtype = getattr(torch, args.dtype)
+    iterations = max(1, args.iterations)
+    warmup = max(0, args.warmup)
+
+    results = []
+    if 'patch' in args.suite:
+        results += patch_suite(device, dtype, iterations, warmup, args.kernels, args.backends, args.batch_size, args.scales)
+    if 'filter' in args.suite:
+        backends = [backend for backend in args.backends if backend != 'auto'] or ['fft', 'lowband']
+        results += filter_suite(device, dtype, iterations, warmup, ['auto'] + backends, args.batch_size, args.scales)
+    if 'backbone-memory' in args.suite:
+        results += backbone_memory_suite(device, dtype, args.kernels)
+
+    env = environment(device, dtype)
+    if args.format == 'json':
+        print(json.dumps({"environment": env, "results": results}, indent=1))
+    elif args.format == 'jsonl':
+        for r in results:
+            print(json.dumps({**env, **r}))
+    else:
+        print(f"torch {env['torch']} on {env['device']} ({env['device_name']}), {env['dtype']}, {env['threads']} threads")
+        print_table(results)
@@ -3,9 +3,13 @@
 
 import cv2 # pip install opencv-python
 import numpy as np 
+import hashlib
+import json
 import os
 import subprocess
-from PIL import Image #pip install pillow
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import argparse
 
 # requires FFMPEG in the same folder like the script to not just create intermediate images but also a vid
@@ -13,23 +17,199 @@ import argparse
 # https://www.ffmpeg.org/download.html
 
 
-def load_images_from_folder(folder):
-    images = []
-    filenames = []
-    for filename in sorted(os.listdir(folder)):
-        img = cv2.imread(os.path.join(folder, filename))
-        if img is not None:
-            images.append(img)
-            filenames.append(filename)
-    return images, filenames
+ease_curves = ('linear', 'cosine', 'smoothstep')
+
+def alpha_schedule(num_intermediates, ease='linear'):
+    t = np.arange(1, num_intermediates + 1, dtype=np.float64) / (num_intermediates + 1)
+    if ease == 'cosine':
+        return 0.5 - 0.5 * np.cos(t * np.pi)
+    if ease == 'smoothstep':
+        return t * t * (3.0 - 2.0 * t)
+    return t
+
+class Blender:
+    # Blends a pair into all its in-betweens at once with 8-bit fixed-point weights in uint16:
+    # (a * (256 - w) + b * w + 128) >> 8 never exceeds 65535. The work is done in row bands so the
+    # uint16 temporaries stay small; all buffers are reused while the frame size stays the same.
+    # blend() returns views of the output buffer, valid until the next call. The buffers are sized
+    # for num_intermediates; blend(count=...) makes fewer in-betweens in a slice of them, so only
+    # the small weight vectors are kept per count.
+    def __init__(self, num_intermediates=3, ease='linear', band_bytes=32 * 2 ** 20):
+        self.num_intermediates = num_intermediates
+        self.ease = ease
+        self.schedules = {}
+        self.band_bytes = band_bytes
+        self.shape = None
+
+    def schedule(self, count):
+        if count not in self.schedules:
+            weights = np.rint(alpha_schedule(count, self.ease) * 256).astype(np.uint16)
+            self.schedules[count] = (weights.reshape(-1, 1, 1, 1), (256 - weights).reshape(-1, 1, 1, 1))
+        return self.schedules[count]
+
+    def allocate(self, shape):
+        n = self.num_intermediates
+        row_bytes = n * shape[1] * shape[2] * 2
+        self.rows = max(1, min(shape[0], self.band_bytes // max(1, row_bytes)))
+        self.out = np.empty((n,) + shape, np.uint8)
+        self.first = np.empty((self.rows,) + shape[1:], np.uint16)
+        self.second = np.empty((self.rows,) + shape[1:], np.uint16)
+        self.work = np.empty((n, self.rows) + shape[1:], np.uint16)
+        self.other = np.empty((n, self.rows) + shape[1:], np.uint16)
+        self.shape = shape
+
+    def blend(self, img1, img2, count=None):
+        count = self.num_intermediates if count is None else min(count, self.num_intermediates)
+        if count == 0:
+            return []
+        if self.shape != img1.shape:
+            self.allocate(img1.shape)
+
+        weights, inverse = self.schedule(count)
+        for start in range(0, img1.shape[0], self.rows):
+            rows = min(self.rows, img1.shape[0] - start)
+            first, second = self.first[:rows], self.second[:rows]
+            work, other = self.work[:count, :rows], self.other[:count, :rows]
+            np.copyto(first, img1[start:start + rows])
+            np.copyto(second, img2[start:start + rows])
+            np.multiply(first, inverse, out=work)
+            np.multiply(second, weights, out=other)
+            work += other
+            work += 128
+            work >>= 8
+            np.copyto(self.out[:count, start:start + rows], work, casting='unsafe')
+        return list(self.out[:count])
+
+def generate_intermediate_images(img1, img2, num_intermediates=3, ease='linear'):
+    return [intermediate.copy() for intermediate in Blender(num_intermediates, ease).blend(img1, img2)]
+
+interp_modes = ('blend', 'flow')
+flow_methods = ('dis', 'farneback')
+
+class FlowInterpolator:
+    # Motion-compensated in-betweens: the forward and backward optical flow of a pair is estimated
+    # once on downscaled grayscale frames, then for each alpha both images are warped toward that
+    # time (I0(x - a * F01) and I1(x - (1 - a) * F10)) and cross-faded. Same interface as Blender.
+    def __init__(self, num_intermediates=3, ease='linear', method='dis', scale=0.5):
+        self.num_intermediates = num_intermediates
+        self.ease = ease
+        self.schedules = {}
+        self.method = method
+        self.scale = scale
+        self.shape = None
+        if method == 'dis':
+            self.dis = cv2.DISOpticalFlow_create(cv2.DISOPTICAL_FLOW_PRESET_MEDIUM)
+
+    def allocate(self, shape):
+        height, width = shape[:2]
+        self.grid_x, self.grid_y = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+        self.map_x = np.empty((height, width), np.float32)
+        self.map_y = np.empty((height, width), np.float32)
+        self.warped = np.empty((2,) + shape, np.uint8)
+        self.out = np.empty((self.num_intermediates,) + shape, np.uint8)
+        self.small = (max(8, round(width * self.scale)), max(8, round(height * self.scale)))
+        self.shape = shape
+
+    def flow(self, first, second):
+        if self.method == 'dis':
+            return self.dis.calc(first, second, None)
+        return cv2.calcOpticalFlowFarneback(first, second, None, 0.5, 4, 21, 5, 7, 1.5, 0)
+
+    def full_flow(self, flow):
+        # Back to full resolution, with the displacements scaled from small to full pixels.
+        flow = cv2.resize(flow, (self.shape[1], self.shape[0]), interpolation=cv2.INTER_LINEAR)
+        flow[..., 0] *= self.shape[1] / self.small[0]
+        flow[..., 1] *= self.shape[0] / self.small[1]
+        return flow
+
+    def warp(self, img, flow, amount, dst):
+        np.multiply(flow[..., 0], -amount, out=self.map_x)
+        self.map_x += self.grid_x
+        np.multiply(flow[..., 1], -amount, out=self.map_y)
+        self.map_y += self.grid_y
+        return cv2.remap(img, self.map_x, self.map_y, cv2.INTER_LINEAR, dst=dst, borderMode=cv2.BORDER_REPLICATE)
+
+    def schedule(self, count):
+        if count not in self.schedules:
+            self.schedules[count] = alpha_schedule(count, self.ease)
+        return self.schedules[count]
+
+    def blend(self, img1, img2, count=None):
+        count = self.num_intermediates if count is None else min(count, self.num_intermediates)
+        if count == 0:
+            return []
+        if self.shape != img1.shape:
+            self.allocate(img1.shape)
 
-def generate_intermediate_images(img1, img2, num_intermediates=3):
-    intermediates = []
-    for i in range(1, num_intermediates + 1):
-        alpha = i / (num_intermediates + 1)
-        intermediate = cv2.addWeighted(img1, 1 - alpha, img2, alpha, 0)
-        intermediates.append(intermediate)
-    return intermediates
+        gray1 = cv2.resize(cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY), self.small, interpolation=cv2.INTER_AREA)
+        gray2 = cv2.resize(cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY), self.small, interpolation=cv2.INTER_AREA)
+        forward = self.full_flow(self.flow(gray1, gray2))
+        backward = self.full_flow(self.flow(gray2, gray1))
+
+        for i, alpha in enumerate(self.schedule(count)):
+            self.warp(img1, forward, alpha, self.warped[0])
+            self.warp(img2, backward, 1.0 - alpha, self.warped[1])
+            cv2.addWeighted(self.warped[0], 1.0 - alpha, self.warped[1], alpha, 0, dst=self.out[i])
+        return list(self.out[:count])
+
+def frame_thumbnail(img, width=64):
+    height = max(1, round(img.shape[0] * width / img.shape[1]))
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+class AdaptiveInterpolator:
+    # Spends the in-betweens where the motion is. A pair's difference is the mean absolute gray
+    # level difference of 64 px wide thumbnails; the pair gets num_intermediates scaled by its
+    # difference over the running mean, capped at max_intermediates and at the budget left over
+    # from earlier pairs (num_intermediates per kept pair), so the video is never longer than with
+    # a fixed count. A pair below duplicate_threshold returns None: the second image is dropped
+    # and the next one is compared against the first. One interpolator sized for
+    # max_intermediates makes every count in a slice of its buffers.
+    def __init__(self, num_intermediates=3, ease='linear', interp='blend', flow_method='dis', max_intermediates=None, duplicate_threshold=0.5):
+        self.num_intermediates = num_intermediates
+        self.max_intermediates = 4 * num_intermediates if max_intermediates is None else max_intermediates
+        self.duplicate_threshold = duplicate_threshold
+        self.interpolator = make_interpolator(self.max_intermediates, ease, interp, flow_method)
+        self.thumbnail = (None, None)
+        self.pairs = 0
+        self.spent = 0
+        self.total_difference = 0.0
+
+    def thumbnails(self, img1, img2):
+        # The second image of a pair is the first of the next, so its thumbnail is kept.
+        first = self.thumbnail[1] if self.thumbnail[0] is img1 else frame_thumbnail(img1)
+        second = frame_thumbnail(img2)
+        self.thumbnail = (img2, second)
+        return first, second
+
+    def count(self, difference):
+        if difference < self.duplicate_threshold:
+            return None
+        self.pairs += 1
+        self.total_difference += difference
+        mean = max(self.total_difference / self.pairs, 1e-6)
+        wanted = round(self.num_intermediates * difference / mean)
+        count = max(0, min(wanted, self.max_intermediates, self.pairs * self.num_intermediates - self.spent))
+        self.spent += count
+        return count
+
+    def blend(self, img1, img2):
+        first, second = self.thumbnails(img1, img2)
+        count = self.count(float(cv2.absdiff(first, second).mean()))
+        if count is None:
+            # img2 is dropped, so img1 stays the first image of the next pair.
+            self.thumbnail = (img1, first)
+            return None
+        return self.interpolator.blend(img1, img2, count)
+
+def make_interpolator(num_intermediates=3, ease='linear', interp='blend', flow_method='dis', adaptive=False, max_intermediates=None, duplicate_threshold=0.5):
+    # Interpolators return the in-betweens of a pair; the adaptive one returns None for a pair
+    # whose second image should be dropped.
+    if adaptive:
+        return AdaptiveInterpolator(num_intermediates, ease, interp, flow_method, max_intermediates, duplicate_threshold)
+    if interp == 'flow':
+        return FlowInterpolator(num_intermediates, ease, flow_method)
+    return Blender(num_intermediates, ease)
 
 def save_images(images, base_filename, output_folder):
     base_name, ext = os.path.splitext(base_filename)
@@ -43,43 +223,390 @@ def create_video_from_images(folder, output_video, fps=30):
         '-c:v', 'libx264', '-pix_fmt', 'yuv420p', output_video
     ])
 
-def upscale_image(image, scale_factor=2):
-    pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
-    new_size = (pil_image.width * scale_factor, pil_image.height * scale_factor)
-    upscaled_image = pil_image.resize(new_size, Image.LANCZOS)
-    return cv2.cvtColor(np.array(upscaled_image), cv2.COLOR_RGB2BGR)
-
-def resize_images(images, size):
-    resized_images = []
-    for img in images:
-        resized_img = cv2.resize(img, size)
-        resized_images.append(resized_img)
-    return resized_images
-
-def ensure_three_channels(images):
-    converted_images = []
-    for img in images:
-        if len(img.shape) == 2:
-            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-        elif img.shape[2] == 4:
-            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-        converted_images.append(img)
-    return converted_images
-
-def main(folder, num_intermediates=3, output_video='output.mp4', upscale=False):
-    images, filenames = load_images_from_folder(folder)
-    if upscale:
-        images = [upscale_image(img) for img in images]
-    
-    images = ensure_three_channels(images)
-    
-    if images:
-        size = (images[0].shape[1], images[0].shape[0])
-        images = resize_images(images, size)
+def normalize_frame(img, size=None, upscale=False):
+    # One pass from a decoded image to a video frame: gray and BGRA become BGR (alpha is dropped),
+    # then a single resize goes straight to `size`, or to the image scaled by the upscale factor
+    # (True means 2x). Upscaling uses OpenCV's threaded Lanczos; steps that would not change the
+    # image are skipped, so an already normalized frame is returned as is.
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    elif img.shape[2] == 4:
+        img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+
+    factor = 2 if upscale is True else (upscale or 1)
+    height, width = img.shape[:2]
+    if size is None:
+        size = (round(width * factor), round(height * factor))
+    if (width, height) == size:
+        return img
+    lanczos = factor > 1 and size[0] > width and size[1] > height
+    return cv2.resize(img, size, interpolation=cv2.INTER_LANCZOS4 if lanczos else cv2.INTER_LINEAR)
+
+class FrameCache:
+    # Normalized frames (decoded, three channels, upscaled, resized) as .npy files that are memory
+    # mapped on a hit. The key is a hash of the image file's bytes plus the processing parameters,
+    # so renamed or rewritten images are handled. Hits refresh a file's mtime; once the folder
+    # grows past max_bytes the least recently used files are deleted.
+    version = 2
+
+    def __init__(self, folder, max_bytes=2 * 2 ** 30):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.added = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, data, size, upscale):
+        digest = hashlib.blake2b(data, digest_size=16)
+        digest.update(repr((self.version, size, upscale)).encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        path = os.path.join(self.folder, key + '.npy')
+        try:
+            img = np.load(path, mmap_mode='r')
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return img
+
+    def put(self, key, img):
+        path = os.path.join(self.folder, key + '.npy')
+        partial = f'{path}.{os.getpid()}.tmp'
+        with open(partial, 'wb') as file:
+            np.save(file, img)
+        os.replace(partial, path)
+        # Eviction scans the folder, so it only runs after a sixteenth of the budget was added.
+        self.added += img.nbytes
+        if self.added > self.max_bytes // 16:
+            self.evict()
+
+    def evict(self):
+        self.added = 0
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith('.npy'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+def load_frame(path, size=None, upscale=False, cache=None):
+    if cache is None:
+        img = cv2.imread(path)
+    else:
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            return None
+        key = cache.key(data, size, upscale)
+        img = cache.get(key)
+        if img is not None:
+            return img
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+    img = normalize_frame(img, size, upscale)
+    if cache is not None:
+        cache.put(key, img)
+    return img
+
+def iter_frames(folder, upscale=False, cache=None):
+    size = None
+    for path in list_image_files(folder):
+        img = load_frame(path, size, upscale, cache)
+        if img is None:
+            continue
+        if size is None:
+            size = (img.shape[1], img.shape[0])
+        yield img
+
+def list_image_files(folder):
+    paths = [os.path.join(folder, filename) for filename in sorted(os.listdir(folder))]
+    return [path for path in paths if os.path.isfile(path) and cv2.haveImageReader(path)]
+
+def open_ffmpeg(output_video, size, fps=30):
+    return subprocess.Popen([
+        'ffmpeg', '-y', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{size[0]}x{size[1]}',
+        '-framerate', str(fps), '-i', '-',
+        '-c:v', 'libx264', '-pix_fmt', 'yuv420p', output_video
+    ], stdin=subprocess.PIPE)
+
+def stream_video(folder, num_intermediates=3, output_video='output.mp4', upscale=False, fps=30, ease='linear', interp='blend', flow_method='dis', cache=None, adaptive=False, max_intermediates=None, duplicate_threshold=0.5):
+    # Only the previous and the current image are held in memory; every frame goes to ffmpeg's
+    # stdin as raw BGR in playback order, nothing is written to the folder.
+    process = None
+    previous = None
+    blender = make_interpolator(num_intermediates, ease, interp, flow_method, adaptive, max_intermediates, duplicate_threshold)
+    try:
+        for img in iter_frames(folder, upscale, cache):
+            if process is None:
+                process = open_ffmpeg(output_video, (img.shape[1], img.shape[0]), fps)
+            if previous is not None:
+                intermediates = blender.blend(previous, img)
+                if intermediates is None:
+                    continue
+                for intermediate in intermediates:
+                    process.stdin.write(intermediate.tobytes())
+            process.stdin.write(img.tobytes())
+            previous = img
+    except BrokenPipeError:
+        pass
+    finally:
+        if process is not None:
+            close_ffmpeg(process, output_video)
+
+def close_ffmpeg(process, output_video):
+    process.stdin.close()
+    if process.wait() != 0:
+        print(f'ffmpeg exited with code {process.returncode}, {output_video} may be incomplete')
+
+def render_segment(paths, size, num_intermediates, upscale, output_folder=None, include_last=False, ease='linear', interp='blend', flow_method='dis', cache=None, adaptive=False, max_intermediates=None, duplicate_threshold=0.5):
+    # Worker task for consecutive images: saves the in-betweens of each pair to output_folder, or
+    # returns the raw BGR frames (each image followed by its in-betweens). The segment's last image
+    # starts the next segment, so it is only added to the frames of the final one.
+    frames = []
+    previous = None
+    blender = make_interpolator(num_intermediates, ease, interp, flow_method, adaptive, max_intermediates, duplicate_threshold)
+    for path in paths:
+        img = load_frame(path, size, upscale, cache)
+        if img is None:
+            continue
+        if previous is not None:
+            intermediates = blender.blend(previous[1], img)
+            if intermediates is None:
+                # Images on disk are never dropped, only their in-betweens are skipped.
+                if output_folder is None:
+                    continue
+                intermediates = []
+            if output_folder is not None:
+                save_images(intermediates, os.path.basename(previous[0]), output_folder)
+            else:
+                frames.append(previous[1].tobytes())
+                frames.extend(intermediate.tobytes() for intermediate in intermediates)
+        previous = (path, img)
+    if output_folder is None and include_last and previous is not None:
+        frames.append(previous[1].tobytes())
+    return b''.join(frames)
+
+def ordered_results(executor, tasks, window):
+    # Bounded reorder buffer: at most `window` tasks are in flight and results come back in
+    # submission order, however the workers finish.
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(*task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def render_parallel(folder, num_intermediates=3, output_video='output.mp4', upscale=False, stream=False, workers=2, pairs_per_task=4, ease='linear', interp='blend', flow_method='dis', cache=None, adaptive=False, max_intermediates=None, duplicate_threshold=0.5, buffer_bytes=1024 * 2 ** 20):
+    paths = list_image_files(folder)
+    size = None
+    for path in paths:
+        first = load_frame(path, None, upscale, cache)
+        if first is not None:
+            size = (first.shape[1], first.shape[0])
+            break
+    if size is None:
+        return
+
+    output_folder = None if stream else folder
+    window = 2 * workers
+    if stream:
+        # Streamed tasks return their raw frames, at most num_intermediates + 1 per pair (adaptive
+        # included). Tasks shrink to fit the buffer and only as many are in flight as it holds, even
+        # if that leaves workers idle on large frames.
+        pair_bytes = (num_intermediates + 1) * size[0] * size[1] * 3
+        pairs_per_task = max(1, min(pairs_per_task, buffer_bytes // pair_bytes))
+        window = max(1, min(window, buffer_bytes // (pairs_per_task * pair_bytes)))
+
+    tasks = []
+    for start in range(0, max(1, len(paths) - 1), pairs_per_task):
+        segment = paths[start:start + pairs_per_task + 1]
+        include_last = start + pairs_per_task + 1 >= len(paths)
+        tasks.append((render_segment, segment, size, num_intermediates, upscale, output_folder, include_last, ease, interp, flow_method, cache, adaptive, max_intermediates, duplicate_threshold))
+
+    process = open_ffmpeg(output_video, size) if stream else None
+    try:
+        # One OpenCV thread per worker, the processes already use every core.
+        with ProcessPoolExecutor(max_workers=workers, initializer=cv2.setNumThreads, initargs=(1,)) as executor:
+            for data in ordered_results(executor, tasks, window):
+                if process is not None:
+                    process.stdin.write(data)
+    except BrokenPipeError:
+        pass
+    finally:
+        # Forked workers hold a copy of ffmpeg's stdin, so it only sees EOF once the pool is gone.
+        if process is not None:
+            close_ffmpeg(process, output_video)
+
+    if not stream:
+        create_video_from_images(folder, output_video)
+
+def watch_state_path(output_video):
+    return os.path.splitext(output_video)[0] + '_segments'
+
+def new_watch_state(settings):
+    return {'settings': settings, 'last': None, 'size': None, 'segments': []}
+
+def load_watch_state(segment_folder, settings):
+    # State from an earlier run with the same settings, otherwise a fresh one; segments of a run
+    # with other settings are left alone but no longer listed.
+    try:
+        with open(os.path.join(segment_folder, 'state.json'), encoding='utf8') as file:
+            state = json.load(file)
+        if state.get('settings') == settings and all(os.path.isfile(os.path.join(segment_folder, name)) for name in state['segments']):
+            return state
+    except (OSError, ValueError, KeyError):
+        pass
+    return new_watch_state(settings)
+
+def save_watch_state(segment_folder, state):
+    path = os.path.join(segment_folder, 'state.json')
+    with open(path + '.tmp', 'w', encoding='utf8') as file:
+        json.dump(state, file, indent=2)
+    os.replace(path + '.tmp', path)
+
+def completed_frames(folder, last, settle):
+    # Images sorting after the last processed one, up to the first that may still be written.
+    ready = []
+    now = time.time()
+    for path in list_image_files(folder):
+        if last is not None and os.path.basename(path) <= last:
+            continue
+        if now - os.path.getmtime(path) < settle:
+            break
+        ready.append(path)
+    return ready
+
+def concat_segments(segment_folder, segments, output_video):
+    # Stream copy of the segments into the preview, replaced atomically so a player never sees a
+    # half-written file.
+    list_path = os.path.join(segment_folder, 'segments.txt')
+    with open(list_path, 'w', encoding='utf8') as file:
+        for name in segments:
+            file.write(f"file '{name}'\n")
+    base, ext = os.path.splitext(output_video)
+    partial = f'{base}.partial{ext}'
+    result = subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_path, '-c', 'copy', partial])
+    if result.returncode == 0:
+        os.replace(partial, output_video)
+    else:
+        print(f'ffmpeg exited with code {result.returncode}, {output_video} was not updated')
+
+def watch_video(folder, num_intermediates=3, output_video='output.mp4', upscale=False, fps=30, ease='linear', interp='blend', flow_method='dis', interval=2.0, cache=None, adaptive=False, max_intermediates=None, duplicate_threshold=0.5):
+    # Follows a folder that is still being filled (e.g. by Generate forever): every poll encodes the
+    # frames that arrived since the last one, with the in-betweens leading up to them, into a new
+    # MPEG-TS segment and rebuilds the preview from the segments without re-encoding. The state
+    # next to the segments lets a restarted watch continue after the last processed image.
+    segment_folder = watch_state_path(output_video)
+    os.makedirs(segment_folder, exist_ok=True)
+    settings = {'num_intermediates': num_intermediates, 'upscale': upscale, 'fps': fps, 'ease': ease, 'interp': interp, 'flow_method': flow_method}
+    state = load_watch_state(segment_folder, settings)
+    size = tuple(state['size']) if state['size'] else None
+    previous = load_frame(os.path.join(folder, state['last']), size, upscale, cache) if state['last'] else None
+    if state['last'] and previous is None:
+        print(f"{state['last']} is gone, starting a new preview")
+        state = new_watch_state(settings)
+        size = None
+
+    blender = make_interpolator(num_intermediates, ease, interp, flow_method, adaptive, max_intermediates, duplicate_threshold)
+    print(f'Watching {folder}, press Ctrl+C to stop')
+    try:
+        while True:
+            # Each new image is encoded as soon as it is loaded, so only the previous frame is kept
+            # however long the backlog is. The segment is only opened once a frame is written:
+            # when every new image is a duplicate there is nothing to encode, and an empty segment
+            # would break the concat.
+            name = f"segment_{len(state['segments']) + 1:05d}.ts"
+            process = None
+            last = None
+            loaded = written = 0
+            try:
+                for path in completed_frames(folder, state['last'], interval):
+                    img = load_frame(path, size, upscale, cache)
+                    if img is None:
+                        break
+                    if size is None:
+                        size = (img.shape[1], img.shape[0])
+                    last = os.path.basename(path)
+                    loaded += 1
+                    intermediates = []
+                    if previous is not None:
+                        intermediates = blender.blend(previous, img)
+                        if intermediates is None:
+                            continue
+                    if process is None:
+                        process = open_ffmpeg(os.path.join(segment_folder, name), size, fps)
+                    for intermediate in intermediates:
+                        process.stdin.write(intermediate.tobytes())
+                    process.stdin.write(img.tobytes())
+                    previous = img
+                    written += 1
+            finally:
+                if process is not None:
+                    process.stdin.close()
+            if process is not None and process.wait() != 0:
+                print(f'ffmpeg exited with code {process.returncode}, stopping')
+                return
+
+            if last is not None:
+                state['last'] = last
+                state['size'] = list(size)
+                if process is not None:
+                    state['segments'].append(name)
+                save_watch_state(segment_folder, state)
+                if process is not None:
+                    concat_segments(segment_folder, state['segments'], output_video)
+                    print(f"{name}: {written} of {loaded} new images, {output_video} updated")
+                else:
+                    print(f"{loaded} new images, all duplicates")
+
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+def main(folder, num_intermediates=3, output_video='output.mp4', upscale=False, stream=False, workers=1, ease='linear', interp='blend', flow_method='dis', watch=False, interval=2.0, cache_dir=None, cache_size=2048, adaptive=False, max_intermediates=None, duplicate_threshold=0.5, upscale_factor=2, buffer_size=1024):
+    if upscale is True:
+        upscale = upscale_factor
+    cache = FrameCache(cache_dir, cache_size * 2 ** 20) if cache_dir else None
+
+    if watch:
+        watch_video(folder, num_intermediates, output_video, upscale, ease=ease, interp=interp, flow_method=flow_method, interval=interval, cache=cache, adaptive=adaptive, max_intermediates=max_intermediates, duplicate_threshold=duplicate_threshold)
+        return
+
+    if workers > 1:
+        render_parallel(folder, num_intermediates, output_video, upscale, stream, workers, ease=ease, interp=interp, flow_method=flow_method, cache=cache, adaptive=adaptive, max_intermediates=max_intermediates, duplicate_threshold=duplicate_threshold, buffer_bytes=buffer_size * 2 ** 20)
+        return
+
+    if stream:
+        stream_video(folder, num_intermediates, output_video, upscale, ease=ease, interp=interp, flow_method=flow_method, cache=cache, adaptive=adaptive, max_intermediates=max_intermediates, duplicate_threshold=duplicate_threshold)
+        return
+
+    images, filenames = [], []
+    for path in list_image_files(folder):
+        img = load_frame(path, (images[0].shape[1], images[0].shape[0]) if images else None, upscale, cache)
+        if img is not None:
+            images.append(img)
+            filenames.append(os.path.basename(path))
     
+    blender = make_interpolator(num_intermediates, ease, interp, flow_method, adaptive, max_intermediates, duplicate_threshold)
     for i in range(len(images) - 1):
-        intermediates = generate_intermediate_images(images[i], images[i + 1], num_intermediates)
-        save_images(intermediates, filenames[i], folder)
+        intermediates = blender.blend(images[i], images[i + 1])
+        # The images themselves are part of the video, so duplicates only lose their in-betweens.
+        if intermediates is not None:
+            save_images(intermediates, filenames[i], folder)
     create_video_from_images(folder, output_video)
 
 if __name__ == "__main__":
@@ -88,5 +615,19 @@ if __name__ == "__main__":
     parser.add_argument('--num_intermediates', type=int, default=3, help='Number of intermediate images to generate (default: 3)')
     parser.add_argument('--output_video', type=str, default='output.mp4', help='Output video file name (default: output.mp4)')
     parser.add_argument('--upscale', action='store_true', help='Upscale images by 2x using lanczos before processing (set this to scale images up)')
+    parser.add_argument('--upscale_factor', type=float, default=2, help='Scale factor of --upscale (default: 2)')
+    parser.add_argument('--stream', action='store_true', help='Pipe frames straight into ffmpeg without writing intermediate images (constant memory)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes for decoding, upscaling, blending and encoding (default: 1)')
+    parser.add_argument('--buffer_size', type=int, default=1024, help='Most MB of rendered frames waiting for ffmpeg with --workers and --stream (default: 1024)')
+    parser.add_argument('--ease', type=str, default='linear', choices=ease_curves, help='Alpha schedule of the intermediate images (default: linear)')
+    parser.add_argument('--interp', type=str, default='blend', choices=interp_modes, help='Cross-fade the images or warp them along their optical flow (default: blend)')
+    parser.add_argument('--flow_method', type=str, default='dis', choices=flow_methods, help='Optical flow estimator for --interp flow (default: dis)')
+    parser.add_argument('--watch', action='store_true', help='Keep polling the folder and append new images to the video as segments, resuming after a restart')
+    parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls in --watch mode; images must be unchanged this long (default: 2)')
+    parser.add_argument('--cache_dir', type=str, default=None, help='Keep decoded and upscaled frames in this folder so reruns skip decoding (default: off)')
+    parser.add_argument('--cache_size', type=int, default=2048, help='Size limit of --cache_dir in MB, least recently used frames are removed first (default: 2048)')
+    parser.add_argument('--adaptive', action='store_true', help='Vary the number of intermediate images per pair with the difference between the images and drop duplicates, using at most num_intermediates per pair on average')
+    parser.add_argument('--max_intermediates', type=int, default=None, help='Most intermediate images for one pair with --adaptive (default: 4x num_intermediates)')
+    parser.add_argument('--duplicate_threshold', type=float, default=0.5, help='Mean gray level difference below which --adaptive treats an image as a duplicate (default: 0.5)')
     args = parser.parse_args()
-    main(args.folder, args.num_intermediates, args.output_video, args.upscale)
+    main(args.folder, args.num_intermediates, args.output_video, args.upscale, args.stream, args.workers, args.ease, args.interp, args.flow_method, args.watch, args.interval, args.cache_dir, args.cache_size, args.adaptive, args.max_intermediates, args.duplicate_threshold, args.upscale_factor, args.buffer_size)
@@ -0,0 +1,105 @@
+import threading
+
+import torch
+
+
+backbone_kernels = ("eager", "low_memory", "torchscript", "compile")
+
+
+def normalized_mean(h):
+    # Channel mean of h, min-max normalized per sample to [0, 1].
+    hidden_mean = h.mean(1).unsqueeze(1)
+    B = hidden_mean.shape[0]
+    hidden_max, _ = torch.max(hidden_mean.view(B, -1), dim=-1, keepdim=True)
+    hidden_min, _ = torch.min(hidden_mean.view(B, -1), dim=-1, keepdim=True)
+    denom = (hidden_max - hidden_min).unsqueeze(2).unsqueeze(3)
+    denom = torch.where(denom == 0, torch.ones_like(denom), denom)
+    return (hidden_mean - hidden_min.unsqueeze(2).unsqueeze(3)) / denom
+
+
+def scale_backbone(h, backbone_scale):
+    half = h.shape[1] // 2
+    h[:, :half] = h[:, :half] * ((backbone_scale - 1) * normalized_mean(h) + 1)
+    return h
+
+
+def scale_backbone_low_memory(h, backbone_scale):
+    # Same results as scale_backbone without its half-size temporary: one aminmax reduction, the
+    # normalization on the (B, 1, H, W) mean in place and the channel half scaled with mul_.
+    B = h.shape[0]
+    hidden_mean = h.mean(1, keepdim=True)
+    hidden_min, hidden_max = torch.aminmax(hidden_mean.view(B, -1), dim=-1)
+    hidden_min = hidden_min.view(B, 1, 1, 1)
+    denom = hidden_max.view(B, 1, 1, 1) - hidden_min
+    denom.masked_fill_(denom == 0, 1)
+    hidden_mean.sub_(hidden_min).div_(denom).mul_(backbone_scale - 1).add_(1)
+    h[:, :h.shape[1] // 2].mul_(hidden_mean)
+    return h
+
+
+# TorchScript needs the scale's type; the float variant keeps Python's double arithmetic on the
+# scale, so both variants round exactly like scale_backbone.
+def scale_backbone_float(h: torch.Tensor, backbone_scale: float) -> torch.Tensor:
+    half = h.shape[1] // 2
+    h[:, :half] = h[:, :half] * ((backbone_scale - 1) * normalized_mean(h) + 1)
+    return h
+
+
+def scale_backbone_tensor(h: torch.Tensor, backbone_scale: torch.Tensor) -> torch.Tensor:
+    half = h.shape[1] // 2
+    h[:, :half] = h[:, :half] * ((backbone_scale - 1) * normalized_mean(h) + 1)
+    return h
+
+
+class BackboneKernels:
+    # Fused variants of scale_backbone, built on first use. A variant that fails to build or run
+    # on a device type is not tried there again; the call falls back to eager.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built = {}
+        self.failed = set()
+
+    def build(self, kernel):
+        if kernel == "torchscript":
+            return {
+                float: torch.jit.script(scale_backbone_float),
+                torch.Tensor: torch.jit.script(scale_backbone_tensor),
+            }
+        if kernel == "compile":
+            compiled = torch.compile(scale_backbone_tensor, dynamic=True)
+            # Float scales go in as 0-dim float64 tensors: they are promoted like Python floats,
+            # and the compiled graph is not specialized on each frame's value.
+            return {
+                float: lambda h, scale: compiled(h, torch.tensor(scale, dtype=torch.float64)),
+                torch.Tensor: compiled,
+            }
+        raise ValueError(f"unknown backbone kernel: {kernel}")
+
+    def get(self, kernel):
+        with self.lock:
+            variants = self.built.get(kernel)
+            if variants is None:
+                variants = self.build(kernel)
+                self.built[kernel] = variants
+            return variants
+
+    def run(self, kernel, h, backbone_scale):
+        if kernel == "low_memory":
+            return scale_backbone_low_memory(h, backbone_scale)
+        if kernel == "eager" or (kernel, h.device.type) in self.failed:
+            return scale_backbone(h, backbone_scale)
+
+        if not isinstance(backbone_scale, torch.Tensor):
+            backbone_scale = float(backbone_scale)
+
+        variant = torch.Tensor if isinstance(backbone_scale, torch.Tensor) else float
+        try:
+            return self.get(kernel)[variant](h, backbone_scale)
+        except Exception as e:
+            with self.lock:
+                self.failed.add((kernel, h.device.type))
+            print(f"FUM: {kernel} backbone kernel failed on {h.device.type} ({e}), falling back to eager.")
+            return scale_backbone(h, backbone_scale)
+
+
+kernels = BackboneKernels()
@@ -0,0 +1,164 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from lib_fum import instrument, spectral
+
+
+_fft_support = {}
+_fft_support_lock = threading.Lock()
+
+
+def _report_fallback(device):
+    print("Device", device, "does not support the torch.fft functions used in the FUM node, switching to CPU.")
+
+
+def supports_fft(device):
+    device = torch.device(device)
+    supported = _fft_support.get(device)
+    if supported is not None:
+        return supported
+
+    with _fft_support_lock:
+        supported = _fft_support.get(device)
+        if supported is not None:
+            return supported
+
+        try:
+            probe = torch.ones((1, 1, 4, 4), device=device)
+            torch.fft.irfft2(torch.fft.rfft2(probe), s=(4, 4))
+            supported = True
+        except Exception:
+            _report_fallback(device)
+            supported = False
+
+        _fft_support[device] = supported
+        return supported
+
+
+def recheck_fft(device):
+    # A failed filter call only says the device lacks torch.fft if the probe now fails too; an
+    # out-of-memory error or a bad input leaves the recorded support as it was.
+    device = torch.device(device)
+    with _fft_support_lock:
+        _fft_support.pop(device, None)
+    return supports_fft(device)
+
+
+class PendingFilter:
+    def __init__(self, offload, device, output, futures, key):
+        self.offload = offload
+        self.device = device
+        self.output = output
+        self.futures = futures
+        self.key = key
+
+    def result(self):
+        for future in self.futures:
+            future.result()
+        return self.offload.upload(self.output, self.device, self.key)
+
+
+class CpuFilterOffload:
+    # Runs the spectral filter on the CPU for devices without torch.fft. Host buffers are reused per
+    # calling thread and shape (pinned when the source is a CUDA device) and the filter runs in a
+    # small worker pool, so the device-to-host copy and the CPU transform overlap with the backbone
+    # work still queued on the device. Jobs sampled on different threads never share a buffer, and
+    # only the buffer_limit most recently used buffer pairs are kept.
+    def __init__(self, max_workers=None, buffer_limit=8):
+        if max_workers is None:
+            max_workers = max(1, min(4, (os.cpu_count() or 2) // 2))
+        self.max_workers = max_workers
+        self.buffer_limit = buffer_limit
+        self.executor = None
+        self.buffers = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _get_executor(self):
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="fum-fft")
+        return self.executor
+
+    def _get_buffers(self, key, shape, dtype, pin):
+        with self.lock:
+            entry = self.buffers.get(key)
+            if entry is None:
+                entry = {
+                    "input": torch.empty(shape, dtype=dtype, pin_memory=pin),
+                    "output": torch.empty(shape, dtype=dtype, pin_memory=pin),
+                    "event": None,
+                }
+                self.buffers[key] = entry
+            self.buffers.move_to_end(key)
+
+            # An evicted pair stays alive for as long as a pending filter still references it.
+            while len(self.buffers) > self.buffer_limit:
+                self.buffers.popitem(last=False)
+
+        # The previous upload from this output buffer may still be in flight.
+        if entry["event"] is not None:
+            entry["event"].synchronize()
+            entry["event"] = None
+        return entry
+
+    def submit(self, x, threshold, scale, backend="fft"):
+        is_cuda = x.device.type == "cuda"
+        key = (threading.get_ident(), tuple(x.shape), x.dtype, is_cuda)
+        entry = self._get_buffers(key, tuple(x.shape), x.dtype, is_cuda and torch.cuda.is_available())
+
+        host_in = entry["input"]
+        host_out = entry["output"]
+        host_in.copy_(x, non_blocking=is_cuda)
+        instrument.stats.moved(x)
+
+        copied = None
+        if is_cuda:
+            copied = torch.cuda.Event()
+            copied.record()
+
+        dim = 0 if x.shape[0] > 1 else 1
+        if isinstance(scale, torch.Tensor):
+            scale = scale.detach().float().cpu()
+
+        def run(rows):
+            if copied is not None:
+                copied.synchronize()
+            chunk_scale = scale
+            if isinstance(scale, torch.Tensor) and dim == 0:
+                chunk_scale = scale[rows[0]]
+            host_out[rows].copy_(spectral.filter_skip(host_in[rows], threshold, chunk_scale, backend))
+
+        executor = self._get_executor()
+        count = x.shape[dim]
+        chunks = max(1, min(self.max_workers, count))
+        futures = []
+        for i in range(chunks):
+            index = [slice(None)] * (dim + 1)
+            index[dim] = slice((count * i) // chunks, (count * (i + 1)) // chunks)
+            futures.append(executor.submit(run, tuple(index)))
+
+        return PendingFilter(self, x.device, host_out, futures, key)
+
+    def upload(self, host, device, key):
+        if device.type != "cuda":
+            return host.to(device, copy=True)
+
+        result = host.to(device, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record()
+        with self.lock:
+            entry = self.buffers.get(key)
+            if entry is not None:
+                entry["event"] = event
+        return result
+
+    def run(self, x, threshold, scale, backend="fft"):
+        return self.submit(x, threshold, scale, backend).result()
+
+
+cpu_offload = CpuFilterOffload()
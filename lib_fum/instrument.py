@@ -0,0 +1,81 @@
+import json
+import os
+import threading
+import time
+
+import torch
+
+
+class HotPathStats(threading.local):
+    # Opt-in timings of the output block patch and the skip filter for the job sampled on this
+    # thread. Callers check `enabled` before timing anything, so a disabled instance costs one
+    # attribute read per call. CUDA work is timed with events that are only resolved in summary().
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+        self.pending = []
+        self.events = {}
+        self.bytes_moved = 0
+
+    def start(self, device):
+        if device.type == "cuda":
+            event = torch.cuda.Event(enable_timing=True)
+            event.record()
+            return event
+        return time.perf_counter()
+
+    def stop(self, token, group, key):
+        entry = self.timings.setdefault(group, {}).setdefault(key, [0, 0.0])
+        entry[0] += 1
+        if isinstance(token, float):
+            entry[1] += time.perf_counter() - token
+        else:
+            end = torch.cuda.Event(enable_timing=True)
+            end.record()
+            self.pending.append((entry, token, end))
+
+    def event(self, name):
+        if self.enabled:
+            self.events[name] = self.events.get(name, 0) + 1
+
+    def moved(self, x, copies=2):
+        if self.enabled and x.device.type != "cpu":
+            self.bytes_moved += copies * x.numel() * x.element_size()
+
+    def summary(self):
+        for entry, start, end in self.pending:
+            end.synchronize()
+            entry[1] += start.elapsed_time(end) / 1000.0
+        self.pending = []
+
+        groups = {
+            group: {key: {"calls": calls, "ms": round(seconds * 1000.0, 3)} for key, (calls, seconds) in sorted(entries.items())}
+            for group, entries in self.timings.items()
+        }
+        blocks = self.timings.get("blocks", {})
+        fum_ms = sum(seconds for _, seconds in blocks.values()) * 1000.0
+        job_ms = (time.perf_counter() - self.started) * 1000.0
+        return {
+            "calls": sum(calls for calls, _ in blocks.values()),
+            "fum_ms": round(fum_ms, 3),
+            "job_ms": round(job_ms, 3),
+            "fum_share": round(fum_ms / job_ms, 4) if job_ms > 0 else 0.0,
+            "blocks": groups.get("blocks", {}),
+            "filters": groups.get("filters", {}),
+            "fft_offloads": self.events.get("fft_offload", 0),
+            "fft_fallbacks": self.events.get("fft_fallback", 0),
+            "bytes_moved": self.bytes_moved,
+        }
+
+
+stats = HotPathStats()
+
+
+def append_log(path, record):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf8") as file:
+        file.write(json.dumps(record) + "\n")
@@ -0,0 +1,138 @@
+import math
+
+import numpy as np
+
+
+param_names = ("b1", "b2", "s1", "s2")
+
+motion_presets = (
+    "Off",
+    "Random Step",
+    "Linear Up",
+    "Linear Down",
+    "YoYo",
+    "Wave",
+    "Triangle",
+    "Saw Up",
+    "Saw Down",
+    "Pulse Return",
+    "Ease In-Out",
+    "Square Hold",
+)
+
+table_chunk_frames = 256
+
+
+def config_signature(cfg):
+    return (
+        cfg["preset"],
+        float(cfg["value"]),
+        float(cfg["min"]),
+        float(cfg["max"]),
+        float(cfg["step"]),
+        float(cfg["speed"]),
+        int(cfg["cycle"]),
+        float(cfg["phase"]),
+    )
+
+
+def period_position(frames, motion_speed, cycle_frames, phase_offset):
+    frames = np.clip(frames, 0, 100000000).astype(np.float64)
+    return (((frames * motion_speed) / float(cycle_frames)) + phase_offset) % 1.0
+
+
+def triangle_wave(t):
+    return 1.0 - np.abs((2.0 * (t % 1.0)) - 1.0)
+
+
+def cosine_ease(x):
+    return 0.5 - 0.5 * np.cos(np.clip(x, 0.0, 1.0) * math.pi)
+
+
+def random_walk(origin, lower, upper, step, count, seed, stream, epoch):
+    # Bounded walk: every step moves by +-step and is clamped into [lower, upper], as the old
+    # stateful preset did. Signs come from a generator seeded per sequence, parameter and epoch.
+    rng = np.random.Generator(np.random.PCG64([int(seed), int(stream), int(epoch)]))
+    moves = np.where(rng.random(count) < 0.5, -step, step)
+    clamped_add = np.frompyfunc(lambda a, b: min(upper, max(lower, a + b)), 2, 1)
+    return clamped_add.accumulate(np.concatenate(([origin], moves)), dtype=object).astype(np.float64)
+
+
+def yoyo(origin, lower, upper, step, steps):
+    # Closed form of the bouncing walk: climb from origin until clamped at upper, then alternate
+    # full sweeps of `sweep` steps, each ending clamped on a bound.
+    sweep = max(1, math.ceil((upper - lower) / step - 1e-9))
+    first = max(1, math.ceil((upper - origin) / step - 1e-9))
+
+    climbing = np.minimum(origin + steps * step, upper)
+    q = np.maximum(steps - first, 0) % (2 * sweep)
+    down = np.maximum(upper - q * step, lower)
+    up = np.minimum(lower + (q - sweep) * step, upper)
+    return np.where(steps <= first, climbing, np.where(q <= sweep, down, up))
+
+
+def evaluate_preset(cfg, frames, steps, seed, stream, epoch):
+    # frames: absolute frame index per row (periodic and linear presets),
+    # steps: frames since this parameter's motion started, 1 for the first (stateful presets).
+    lower = float(cfg["min"])
+    upper = float(cfg["max"])
+    base = min(upper, max(lower, float(cfg["value"])))
+    preset = cfg["preset"]
+
+    if preset == "Off" or upper <= lower:
+        return np.full(frames.shape, base, dtype=np.float64)
+
+    motion_speed = float(cfg["speed"])
+    effective_step = max(0.0001, float(cfg["step"]) * motion_speed)
+    origin = base
+    span = upper - lower
+
+    if preset == "Random Step":
+        walk = random_walk(origin, lower, upper, effective_step, int(steps.max()), seed, stream, epoch)
+        return walk[steps]
+
+    if preset == "Linear Up":
+        return np.clip(origin + (effective_step * frames), lower, upper)
+
+    if preset == "Linear Down":
+        return np.clip(origin - (effective_step * frames), lower, upper)
+
+    if preset == "YoYo":
+        return yoyo(origin, lower, upper, effective_step, steps)
+
+    t = period_position(frames, motion_speed, cfg["cycle"], cfg["phase"])
+
+    if preset == "Wave":
+        normalized = 0.5 + 0.5 * np.sin((2.0 * math.pi * t) - (math.pi / 2.0))
+    elif preset == "Triangle":
+        normalized = triangle_wave(t)
+    elif preset == "Saw Up":
+        normalized = t
+    elif preset == "Saw Down":
+        normalized = 1.0 - t
+    elif preset == "Pulse Return":
+        target = upper if abs(upper - origin) >= abs(origin - lower) else lower
+        return np.clip(origin + ((target - origin) * cosine_ease(triangle_wave(t))), lower, upper)
+    elif preset == "Ease In-Out":
+        normalized = cosine_ease(triangle_wave(t))
+    elif preset == "Square Hold":
+        normalized = np.where(t < 0.5, 1.0, 0.0)
+    else:
+        return np.full(frames.shape, base, dtype=np.float64)
+
+    return np.clip(lower + (span * normalized), lower, upper)
+
+
+def compile_motion_table(configs, first_position, count, frame_origin, frame_step, epochs, seed):
+    # Values of all four parameters for sequence positions [first_position, first_position + count),
+    # as a (count, 4) float32 table. Position p renders frame frame_origin + p * frame_step.
+    positions = np.arange(first_position, first_position + count, dtype=np.int64)
+    frames = frame_origin + positions * frame_step
+    table = np.empty((count, len(param_names)), dtype=np.float32)
+
+    for column, name in enumerate(param_names):
+        epoch = int(epochs.get(name, 0))
+        steps = np.maximum(positions - epoch + 1, 1)
+        table[:, column] = evaluate_preset(configs[name], frames, steps, seed, column, epoch)
+
+    return table
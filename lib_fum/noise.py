@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+
+def tensor_bytes(tensors):
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class NoiseCache:
+    # Noise drawn by the first job of a sequence, per noise key. Every job of a sequence uses the
+    # same seeds and latent size, so later jobs replay the recorded tensors instead of drawing them.
+    # At most `limit` keys and `limit_bytes` of recorded tensors are kept; the key being recorded is
+    # never evicted.
+    def __init__(self, limit=8, draws_per_key=1, limit_bytes=256 * 2 ** 20):
+        self.limit = limit
+        self.limit_bytes = limit_bytes
+        self.draws_per_key = draws_per_key
+        self.records = OrderedDict()
+        self.lock = threading.Lock()
+
+    def record(self, key):
+        with self.lock:
+            draws = self.records.get(key)
+            if draws is None:
+                draws = []
+                self.records[key] = draws
+            self.records.move_to_end(key)
+
+            while len(self.records) > self.limit or (len(self.records) > 1 and self._nbytes() > self.limit_bytes):
+                self.records.popitem(last=False)
+            return draws
+
+    def _nbytes(self):
+        return sum(tensor_bytes(draws) for draws in self.records.values())
+
+    def nbytes(self):
+        with self.lock:
+            return self._nbytes()
+
+    def clear(self):
+        with self.lock:
+            self.records.clear()
+
+
+class NoiseReplay:
+    # Stands in for the processing's ImageRNG. Draws that were recorded are returned as copies; the
+    # wrapped generator is only advanced once a draw past the record is needed, so the noise it
+    # produces from there on is the same as without the cache.
+    def __init__(self, rng, draws, limit=1):
+        self.rng = rng
+        self.draws = draws
+        self.limit = limit
+        self.position = 0
+        self.rng_position = 0
+
+    def __getattr__(self, name):
+        return getattr(self.rng, name)
+
+    def next(self):
+        index = self.position
+        self.position += 1
+
+        if index < len(self.draws):
+            return self.draws[index].clone()
+
+        while self.rng_position < index:
+            self.rng.next()
+            self.rng_position += 1
+
+        x = self.rng.next()
+        self.rng_position += 1
+        if index == len(self.draws) and len(self.draws) < self.limit:
+            self.draws.append(x.clone())
+        return x
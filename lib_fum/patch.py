@@ -0,0 +1,152 @@
+import threading
+import weakref
+
+import torch
+
+from lib_fum import backbone, devices, instrument, schedule, spectral
+
+
+def Fourier_filter(x, threshold, scale, backend="auto", memory_budget=None):
+    stats = instrument.stats
+    if not stats.enabled:
+        return spectral.filter_skip(x, threshold, scale, backend, memory_budget)
+
+    token = stats.start(x.device)
+    x = spectral.filter_skip(x, threshold, scale, backend, memory_budget)
+    stats.stop(token, "filters", spectral.resolve_backend(x.shape[-2], x.shape[-1], threshold, backend))
+    return x
+
+
+class FUMPatchParams(threading.local):
+    # Mutable parameters read by an installed output_block_patch. Updating them is all a new frame
+    # needs, so the patched UNet clone can be reused for the whole session. Values are per thread:
+    # a job sets them and samples on the same thread, so concurrent jobs sharing a clone keep
+    # their own parameters.
+    def __init__(self):
+        self.scale_dict = {}
+        self.filter_backend = "auto"
+        self.backbone_kernel = "eager"
+        self.filter_memory_budget = None
+        self.per_sample_cache = {}
+        self.step_schedule = (0.0, 1.0, 0.0, 0.0, "Linear")
+        self.step_tables = {}
+
+    def update(self, model_channels, b1, b2, s1, s2, filter_backend="auto", step_schedule=None, backbone_kernel="eager", filter_memory_budget=None):
+        self.per_sample_cache = {}
+        self.step_tables = {}
+        self.filter_backend = filter_backend
+        self.backbone_kernel = backbone_kernel
+        self.filter_memory_budget = filter_memory_budget
+        if step_schedule is not None:
+            self.step_schedule = tuple(step_schedule)
+        self.scale_dict = {model_channels * 4: (b1, s1), model_channels * 2: (b2, s2)}
+
+    def compile_step_table(self, total_steps):
+        # One entry per step: None where the strength is 0, otherwise the scales pulled towards 1.
+        table = []
+        for strength in schedule.compile_step_schedule(total_steps, *self.step_schedule):
+            if strength <= 0.0:
+                table.append(None)
+            elif strength >= 1.0:
+                table.append(self.scale_dict)
+            else:
+                table.append({
+                    channels: (1 + (b - 1) * strength, 1 + (s - 1) * strength)
+                    for channels, (b, s) in self.scale_dict.items()
+                })
+        self.step_tables[total_steps] = table
+        return table
+
+    def scales_at(self, step, total_steps):
+        if total_steps <= 0:
+            return self.scale_dict
+
+        table = self.step_tables.get(total_steps)
+        if table is None:
+            table = self.compile_step_table(total_steps)
+        return table[min(max(int(step), 0), total_steps - 1)]
+
+    def per_sample(self, value, batch_size, device, dtype):
+        # Per-frame values arrive as one entry per latent; cond/uncond chunks repeat the latent batch.
+        if not isinstance(value, torch.Tensor):
+            return value
+
+        key = (id(value), batch_size, device, dtype)
+        cached = self.per_sample_cache.get(key)
+        if cached is None:
+            repeats = max(1, -(-batch_size // value.shape[0]))
+            cached = value.to(device=device, dtype=dtype).repeat(repeats)[:batch_size]
+            self.per_sample_cache[key] = cached
+        return cached
+
+
+# base unet patcher -> (base model, patched clone, FUMPatchParams)
+patched_unets = weakref.WeakKeyDictionary()
+
+
+def make_output_block_patch(params):
+    def scale_features(h, hsp):
+        scales = params.scales_at(schedule.progress.step, schedule.progress.total)
+
+        if scales is not None:
+            scale = scales.get(h.shape[1], None)
+            if scale is not None:
+                backbone_scale = params.per_sample(scale[0], h.shape[0], h.device, h.dtype)
+                skip_scale = params.per_sample(scale[1], hsp.shape[0], hsp.device, torch.float32)
+                if isinstance(backbone_scale, torch.Tensor):
+                    backbone_scale = backbone_scale.view(-1, 1, 1, 1)
+
+                backend = spectral.resolve_backend(hsp.shape[-2], hsp.shape[-1], 1, params.filter_backend)
+                pending = None
+                if backend == "fft" and not devices.supports_fft(hsp.device):
+                    pending = devices.cpu_offload.submit(hsp, threshold=1, scale=skip_scale, backend=backend)
+
+                h = backbone.kernels.run(params.backbone_kernel, h, backbone_scale)
+
+                if pending is not None:
+                    instrument.stats.event("fft_offload")
+                    hsp = pending.result()
+                else:
+                    try:
+                        hsp = Fourier_filter(hsp, threshold=1, scale=skip_scale, backend=backend, memory_budget=params.filter_memory_budget)
+                    except torch.cuda.OutOfMemoryError:
+                        raise
+                    except Exception:
+                        # This call falls back to the CPU; later ones only do if the FFT probe
+                        # confirms the device cannot run torch.fft.
+                        instrument.stats.event("fft_fallback")
+                        if backend == "fft":
+                            devices.recheck_fft(hsp.device)
+                        hsp = devices.cpu_offload.run(hsp, threshold=1, scale=skip_scale, backend=backend)
+
+        return h, hsp
+
+    def output_block_patch(h, hsp, transformer_options):
+        schedule.progress.advance(transformer_options.get("sigmas", transformer_options))
+
+        stats = instrument.stats
+        if not stats.enabled:
+            return scale_features(h, hsp)
+
+        token = stats.start(h.device)
+        h, hsp = scale_features(h, hsp)
+        stats.stop(token, "blocks", f"{h.shape[1]}x{h.shape[2]}x{h.shape[3]}")
+        return h, hsp
+
+    return output_block_patch
+
+
+def patch_FUM_v2(unet_patcher, b1, b2, s1, s2, filter_backend="auto", step_schedule=None, backbone_kernel="eager", filter_memory_budget=None):
+    model_channels = unet_patcher.model.diffusion_model.config.get("model_channels")
+
+    cached = patched_unets.get(unet_patcher)
+    if cached is None or cached[0] is not unet_patcher.model:
+        params = FUMPatchParams()
+        m = unet_patcher.clone()
+        m.set_model_output_block_patch(make_output_block_patch(params))
+        cached = (unet_patcher.model, m, params)
+        patched_unets[unet_patcher] = cached
+
+    _, m, params = cached
+    params.update(model_channels, b1, b2, s1, s2, filter_backend, step_schedule, backbone_kernel, filter_memory_budget)
+    return m
@@ -0,0 +1,81 @@
+import math
+
+# First-order samplers without noise or history: the denoiser input of step i is the complete
+# sampler state at step i, so sampling can restart there from the schedule's tail.
+prefix_samplers = ("Euler",)
+
+
+class PrefixSnapshot:
+    # Latent of a job right before the first step where FUM changes the UNet, and the sigma it was
+    # taken at. Until that step every job with the same key computes exactly this latent.
+    def __init__(self, key, step, total, x, sigma):
+        self.key = key
+        self.step = step
+        self.total = total
+        self.x = x
+        self.sigma = sigma
+
+    def matches_sigma(self, sigma):
+        return math.isclose(float(sigma), self.sigma, rel_tol=1e-6, abs_tol=1e-8)
+
+
+class PrefixCapture:
+    # Armed on the sampler of a job whose key has no snapshot yet. The sampler reports the latent of
+    # every step to its callback_state before updating it; the capture takes the one at `step` if
+    # it still belongs to the schedule it was armed for (same step, sigma and batch size).
+    def __init__(self, key, step, total, sigma, batch_size, store):
+        self.key = key
+        self.step = step
+        self.total = total
+        self.sigma = float(sigma)
+        self.batch_size = batch_size
+        self.store = store
+        self.sampler = None
+        self.callback_state = None
+
+    def arm(self, sampler):
+        # Only this job's sampler is wrapped, so a capture can never fire in another job.
+        callback_state = sampler.callback_state
+
+        def callback_state_with_capture(d):
+            if self.sampler is sampler and d.get("i") is not None and d["i"] >= self.step:
+                self.disarm()
+                if d["i"] == self.step:
+                    self.take(d["x"], d["sigma"])
+            return callback_state(d)
+
+        self.sampler = sampler
+        self.callback_state = callback_state
+        sampler.callback_state = callback_state_with_capture
+
+    def disarm(self):
+        if self.sampler is not None:
+            self.sampler.callback_state = self.callback_state
+            self.sampler = None
+            self.callback_state = None
+
+    def take(self, x, sigma):
+        if x.shape[0] != self.batch_size or not math.isclose(float(sigma), self.sigma, rel_tol=1e-6, abs_tol=1e-8):
+            return None
+
+        snapshot = PrefixSnapshot(self.key, self.step, self.total, x.detach().clone(), self.sigma)
+        self.store(snapshot)
+        return snapshot
+
+
+def resume_scale(sigma, sgm_noise_multiplier=False):
+    # The sampler multiplies the initial noise by this factor, so the snapshot is divided by it.
+    if sgm_noise_multiplier:
+        return math.sqrt(1.0 + sigma ** 2.0)
+    return sigma
+
+
+def truncate_sigmas(sampler, step):
+    # The next get_sigmas call (the one sample() makes) returns the schedule from `step` on.
+    get_sigmas = sampler.get_sigmas
+
+    def get_sigmas_from_step(*args, **kwargs):
+        sampler.get_sigmas = get_sigmas
+        return get_sigmas(*args, **kwargs)[step:]
+
+    sampler.get_sigmas = get_sigmas_from_step
@@ -0,0 +1,106 @@
+import bisect
+import math
+import threading
+
+import torch
+
+
+ramp_curves = ("Linear", "Cosine", "Smoothstep")
+
+
+def ramp_value(x, curve):
+    x = max(0.0, min(1.0, float(x)))
+    if curve == "Cosine":
+        return 0.5 - 0.5 * math.cos(x * math.pi)
+    if curve == "Smoothstep":
+        return x * x * (3.0 - 2.0 * x)
+    return x
+
+
+def compile_step_schedule(total_steps, start, end, ramp_in=0.0, ramp_out=0.0, curve="Linear"):
+    # Strength multiplier per sampling step. Steps are placed on [0, 1] the same way the old
+    # start/end gate did (step / (total - 1)); with both ramps at 0 this is exactly that gate.
+    total_steps = max(1, int(total_steps))
+    strengths = []
+    for step in range(total_steps):
+        t = 0.0 if total_steps <= 1 else step / (total_steps - 1)
+        if t < start or t > end:
+            strengths.append(0.0)
+            continue
+
+        weight = 1.0
+        if ramp_in > 0.0:
+            weight = min(weight, (t - start) / ramp_in)
+        if ramp_out > 0.0:
+            weight = min(weight, (end - t) / ramp_out)
+        strengths.append(ramp_value(weight, curve))
+    return tuple(strengths)
+
+
+class SamplingProgress(threading.local):
+    # Step of the job sampled on this thread, worked out by the output block patch itself: the
+    # sampler's get_sigmas call is recorded once per sampling pass, and the sigma of each UNet call
+    # is looked up in it (the first call of a UNet evaluation pays one scalar read, the other blocks
+    # of that evaluation see the same sigma tensor and reuse the step). Samplers without a sigma
+    # schedule count UNet evaluations instead.
+    def __init__(self):
+        self.capture = None
+        self.reset()
+
+    def reset(self):
+        # A capture left armed by an interrupted job is dropped with it.
+        if self.capture is not None:
+            self.capture.disarm()
+        self.step = 0
+        self.total = 0
+        # A job resumed from a prefix snapshot samples only the schedule's tail; offset and
+        # total_override map its steps back onto the full schedule.
+        self.offset = 0
+        self.total_override = None
+        self.capture = None
+        self.sigmas = None
+        self.start = None
+        self.current = None
+        self.calls = 0
+
+    def follow(self, sampler, total):
+        # Like prefix.truncate_sigmas, the next get_sigmas call (the one sample() makes) is wrapped
+        # once; it also sees a truncated schedule when the job resumes from a prefix snapshot.
+        self.total = self.total_override or total
+        get_sigmas = getattr(sampler, "get_sigmas", None)
+        if get_sigmas is None:
+            return
+
+        def get_sigmas_recorded(*args, **kwargs):
+            sampler.get_sigmas = get_sigmas
+            sigmas = get_sigmas(*args, **kwargs)
+            # Ascending negated sigmas, so bisect finds the step of a sigma.
+            self.sigmas = [-float(sigma) for sigma in sigmas.detach().cpu().tolist()]
+            self.start = None
+            return sigmas
+
+        sampler.get_sigmas = get_sigmas_recorded
+
+    def advance(self, sigma):
+        # A new sigma object means a new UNet evaluation; cond/uncond chunks share it.
+        if sigma is self.current:
+            return
+        self.current = sigma
+
+        if self.sigmas is None or not isinstance(sigma, torch.Tensor):
+            self.step = self.offset + self.calls
+            self.calls += 1
+            return
+
+        # The step whose sigma is the last one at or above this one, so the intermediate sigmas
+        # of second-order samplers count towards the step they belong to. img2img and hires passes
+        # sample the schedule's tail; the first sigma seen is their step 0.
+        value = -float(sigma.reshape(-1)[0]) * (1.0 - 1e-5)
+        index = max(0, bisect.bisect_right(self.sigmas, value) - 1)
+        if self.start is None:
+            self.start = index
+        self.step = index - self.start + self.offset
+        self.total = self.total_override or max(1, len(self.sigmas) - 1 - self.start)
+
+
+progress = SamplingProgress()
@@ -0,0 +1,199 @@
+import json
+import os
+import random
+import re
+import threading
+from collections import OrderedDict
+
+from lib_fum import motion, noise
+
+
+default_sequence_id = "default"
+checkpoint_version = 1
+
+
+def normalize_sequence_id(sequence_id):
+    sequence_id = str(sequence_id or "").strip()
+    return sequence_id or default_sequence_id
+
+
+class SequenceState:
+    # Animation state of one sequence. Callers hold `lock` while reading or advancing it.
+    def __init__(self, sequence_id):
+        self.sequence_id = sequence_id
+        self.lock = threading.RLock()
+        self.frame = 0
+        self.frame_count = 1
+        self.initialized = False
+        self.last_processing_id = None
+        self.signature = None
+        self.position = 0
+        self.motion_seed = None
+        self.motion_epochs = {}
+        self.motion_configs = {}
+        self.motion_table = None
+        # Initial noise and the pre-FUM latent shared by every job of the sequence. Both are keyed,
+        # so a changed model, prompt, seed or size misses instead of reusing stale tensors.
+        self.noise_cache = noise.NoiseCache()
+        self.prefix_snapshot = None
+
+    def reset_motion(self, motion_seed=None):
+        # position counts frames since the motion started; each parameter's stateful presets restart
+        # from their origin at its epoch (the position its settings last changed).
+        self.position = 0
+        if motion_seed is None or int(motion_seed) < 0:
+            motion_seed = random.getrandbits(32)
+        self.motion_seed = int(motion_seed)
+        self.motion_epochs = {}
+        self.motion_configs = {}
+        self.motion_table = None
+
+    def motion_values(self, configs, frame_index, frame_step, frame_count):
+        # Values of the four parameters for the frame_count frames starting at the current position,
+        # read from a table compiled table_chunk_frames positions at a time.
+        if self.motion_seed is None:
+            self.reset_motion()
+
+        for name in motion.param_names:
+            signature = motion.config_signature(configs[name])
+            if self.motion_configs.get(name) != signature:
+                self.motion_configs[name] = signature
+                self.motion_epochs[name] = self.position
+                self.motion_table = None
+
+        position = self.position
+        frame_origin = frame_index - (position * frame_step)
+        cached = self.motion_table
+        if (
+            cached is None
+            or cached[1] != frame_origin
+            or cached[2] != frame_step
+            or not (cached[0] <= position and position + frame_count <= cached[0] + len(cached[3]))
+        ):
+            table = motion.compile_motion_table(
+                configs,
+                position,
+                max(frame_count, motion.table_chunk_frames),
+                frame_origin,
+                frame_step,
+                self.motion_epochs,
+                self.motion_seed,
+            )
+            cached = (position, frame_origin, frame_step, table)
+            self.motion_table = cached
+
+        rows = cached[3][position - cached[0]:position - cached[0] + frame_count]
+        return {name: [round(float(value), 6) for value in rows[:, column]] for column, name in enumerate(motion.param_names)}
+
+    def cache_bytes(self):
+        snapshot = self.prefix_snapshot
+        return self.noise_cache.nbytes() + (noise.tensor_bytes([snapshot.x]) if snapshot is not None else 0)
+
+    def release_caches(self):
+        # Drops the device tensors; the motion state is kept, so the sequence itself can continue.
+        self.noise_cache.clear()
+        self.prefix_snapshot = None
+
+    def to_checkpoint(self):
+        return {
+            "version": checkpoint_version,
+            "sequence_id": self.sequence_id,
+            "frame": self.frame,
+            "frame_count": self.frame_count,
+            "position": self.position,
+            "signature": list(self.signature) if self.signature is not None else None,
+            "motion_seed": self.motion_seed,
+            "motion_epochs": dict(self.motion_epochs),
+            "motion_configs": {name: list(config) for name, config in self.motion_configs.items()},
+        }
+
+    def restore_checkpoint(self, data):
+        # The restored state behaves like a sequence whose last job just finished: the next job
+        # advances from the checkpointed frame and replays the same motion trajectory.
+        self.frame = int(data["frame"])
+        self.frame_count = max(1, int(data.get("frame_count", 1)))
+        self.position = int(data["position"])
+        self.signature = tuple(data["signature"]) if data.get("signature") is not None else None
+        self.motion_seed = int(data["motion_seed"])
+        self.motion_epochs = {name: int(epoch) for name, epoch in data.get("motion_epochs", {}).items()}
+        self.motion_configs = {name: tuple(config) for name, config in data.get("motion_configs", {}).items()}
+        self.motion_table = None
+        self.initialized = True
+        self.last_processing_id = None
+
+
+def checkpoint_path(directory, sequence_id):
+    safe_id = re.sub(r"[^A-Za-z0-9_.-]+", "_", normalize_sequence_id(sequence_id))
+    return os.path.join(directory, f"fum_sequence_{safe_id}.json")
+
+
+def save_checkpoint(path, data):
+    # Written to a temporary file next to the target and swapped in, so a crash never leaves a
+    # truncated checkpoint behind.
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w", encoding="utf8") as file:
+        json.dump(data, file, indent=1)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, "r", encoding="utf8") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(data, dict) or data.get("version") != checkpoint_version:
+        return None
+    return data
+
+
+class SequenceStateStore:
+    # At most `limit` sequences are kept, and the cached tensors of all of them together stay under
+    # `cache_limit` bytes: the least recently used sequences give up their caches first.
+    def __init__(self, limit=64, cache_limit=1024 * 2 ** 20):
+        self.limit = limit
+        self.cache_limit = cache_limit
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, sequence_id):
+        sequence_id = normalize_sequence_id(sequence_id)
+        with self.lock:
+            state = self.states.get(sequence_id)
+            if state is None:
+                state = SequenceState(sequence_id)
+                self.states[sequence_id] = state
+            self.states.move_to_end(sequence_id)
+
+            while len(self.states) > self.limit:
+                self.states.popitem(last=False)
+            self.trim_caches()
+            return state
+
+    def trim_caches(self):
+        sizes = [(state, state.cache_bytes()) for state in self.states.values()]
+        total = sum(size for _, size in sizes)
+        for state, size in sizes[:-1]:
+            if total <= self.cache_limit:
+                break
+            if size:
+                state.release_caches()
+                total -= size
+
+    def release_caches(self, sequence_id):
+        with self.lock:
+            state = self.states.get(normalize_sequence_id(sequence_id))
+        if state is not None:
+            state.release_caches()
+
+    def discard(self, sequence_id):
+        with self.lock:
+            self.states.pop(normalize_sequence_id(sequence_id), None)
+
+
+sequence_states = SequenceStateStore()
@@ -0,0 +1,283 @@
+import math
+import os
+import threading
+
+import torch
+
+
+def fourier_filter_reference(x, threshold, scale):
+    x_freq = torch.fft.fftn(x.float(), dim=(-2, -1))
+    x_freq = torch.fft.fftshift(x_freq, dim=(-2, -1))
+
+    B, C, H, W = x_freq.shape
+    mask = torch.ones((B, C, H, W), device=x.device)
+
+    crow, ccol = H // 2, W // 2
+    mask[..., crow - threshold:crow + threshold, ccol - threshold:ccol + threshold] = scale
+    x_freq = x_freq * mask
+
+    x_freq = torch.fft.ifftshift(x_freq, dim=(-2, -1))
+    x_filtered = torch.fft.ifftn(x_freq, dim=(-2, -1)).real
+
+    return x_filtered.to(x.dtype)
+
+
+_plan_cache = {}
+_plan_cache_lock = threading.Lock()
+_plan_cache_limit = 128
+
+
+def symmetric_mask(H, W, threshold, scale):
+    # The reference filter keeps only the real part of its inverse transform, which is the same as
+    # applying the Hermitian-symmetric half of its (unshifted) mask. A symmetric mask is what lets
+    # rfft2 / irfft2 reproduce the reference exactly.
+    mask = torch.ones((H, W), dtype=torch.float64)
+    crow, ccol = H // 2, W // 2
+    mask[crow - threshold:crow + threshold, ccol - threshold:ccol + threshold] = scale
+    mask = torch.fft.ifftshift(mask)
+    mirrored = torch.roll(torch.flip(mask, dims=(0, 1)), shifts=(1, 1), dims=(0, 1))
+    return (mask + mirrored) * 0.5
+
+
+def build_filter_plan(H, W, threshold, device):
+    # Returns the (rows, cols, band) blocks of the rfft2 half spectrum the filter touches, with the
+    # band weight (0 to 1) of each frequency; the multiplier for a scale is 1 + (scale - 1) * band.
+    # For the usual small thresholds these are the low-frequency corners, so the full-size mask
+    # and the fftshift round trips of the reference are never needed. The plan does not depend on
+    # the scale, so per-frame and per-step scales reuse it.
+    half = (symmetric_mask(H, W, threshold, 2.0) - 1.0)[:, :W // 2 + 1]
+    changed = half != 0.0
+    if not bool(changed.any()):
+        return ()
+
+    row_hits = changed.any(dim=1).nonzero().flatten().tolist()
+    col_hits = changed.any(dim=0).nonzero().flatten().tolist()
+    col_end = col_hits[-1] + 1
+
+    top = [r for r in row_hits if r < (H + 1) // 2]
+    bottom = [r for r in row_hits if r >= (H + 1) // 2]
+    top_end = top[-1] + 1 if top else 0
+    bottom_start = bottom[0] if bottom else H
+
+    if top_end >= bottom_start or (top_end + H - bottom_start) * col_end * 2 > H * (W // 2 + 1):
+        spans = [(0, H)]
+    else:
+        spans = [(0, top_end), (bottom_start, H)]
+
+    blocks = []
+    for start, end in spans:
+        if end > start:
+            block = half[start:end, :col_end].to(device=device, dtype=torch.float32)
+            blocks.append((slice(start, end), slice(0, col_end), block))
+    return tuple(blocks)
+
+
+def get_filter_plan(H, W, threshold, device):
+    key = (H, W, int(threshold), torch.device(device), torch.float32)
+    plan = _plan_cache.get(key)
+    if plan is not None:
+        return plan
+
+    plan = build_filter_plan(H, W, int(threshold), device)
+    with _plan_cache_lock:
+        if len(_plan_cache) >= _plan_cache_limit:
+            _plan_cache.clear()
+        _plan_cache[key] = plan
+    return plan
+
+
+def clear_filter_cache():
+    with _plan_cache_lock:
+        _plan_cache.clear()
+
+
+def per_sample_scale(scale, x):
+    # Per-sample scales are a 1-D tensor over the batch, broadcast against (B, ...) tensors.
+    return scale.to(device=x.device, dtype=torch.float32).view(-1, *([1] * (x.dim() - 1)))
+
+
+def fourier_filter(x, threshold, scale):
+    H, W = x.shape[-2:]
+    plan = get_filter_plan(H, W, threshold, x.device)
+    if isinstance(scale, torch.Tensor):
+        scale = per_sample_scale(scale, x) - 1.0
+    else:
+        scale = float(scale) - 1.0
+        if scale == 0.0:
+            return x
+    if not plan:
+        return x
+
+    x_freq = torch.fft.rfft2(x.float())
+    for rows, cols, band in plan:
+        x_freq[..., rows, cols] *= 1.0 + scale * band
+
+    return torch.fft.irfft2(x_freq, s=(H, W)).to(x.dtype)
+
+
+filter_backends = ("auto", "fft", "lowband")
+
+_basis_cache = {}
+_basis_cache_lock = threading.Lock()
+
+
+def build_lowband_basis(H, W, threshold, device):
+    # Scale-independent low-band weights: the filter is x + (scale - 1) * lowpass(x), and lowpass only
+    # touches a handful of frequencies, so it can be written as small real DFT matmuls instead of
+    # two full 2-D FFTs. Only matmul is needed, which also works on devices without torch.fft.
+    weight = symmetric_mask(H, W, threshold, 2.0) - 1.0
+    rows = weight.abs().sum(dim=1).nonzero().flatten()
+    cols = weight.abs().sum(dim=0).nonzero().flatten()
+    if rows.numel() == 0:
+        return None
+
+    n_h = torch.arange(H, dtype=torch.float64)
+    n_w = torch.arange(W, dtype=torch.float64)
+    angle_h = 2.0 * torch.pi * rows.to(torch.float64)[:, None] * n_h[None, :] / H
+    angle_w = 2.0 * torch.pi * cols.to(torch.float64)[:, None] * n_w[None, :] / W
+
+    def prepare(t):
+        return t.to(device=device, dtype=torch.float32).contiguous()
+
+    # forward_h: (2Kh, H) = [cos; -sin] rows of F_H, forward_w: (W, 2Kw) = [cos^T, sin^T] of F_W,
+    # inverse_h: (H, 2Kh) = [cos^T, sin^T] / H, inverse_w: (2Kw, W) = [cos; -sin] / W.
+    return {
+        "forward_h": prepare(torch.cat([torch.cos(angle_h), -torch.sin(angle_h)], dim=0)),
+        "forward_w": prepare(torch.cat([torch.cos(angle_w), torch.sin(angle_w)], dim=0).t()),
+        "inverse_h": prepare(torch.cat([torch.cos(angle_h), torch.sin(angle_h)], dim=0).t() / H),
+        "inverse_w": prepare(torch.cat([torch.cos(angle_w), -torch.sin(angle_w)], dim=0) / W),
+        "weight": prepare(weight[rows][:, cols]),
+    }
+
+
+def get_lowband_basis(H, W, threshold, device):
+    key = (H, W, int(threshold), torch.device(device), torch.float32)
+    if key in _basis_cache:
+        return _basis_cache[key]
+
+    basis = build_lowband_basis(H, W, int(threshold), device)
+    with _basis_cache_lock:
+        if len(_basis_cache) >= _plan_cache_limit:
+            _basis_cache.clear()
+        _basis_cache[key] = basis
+    return basis
+
+
+def lowband_filter(x, threshold, scale):
+    H, W = x.shape[-2:]
+    basis = get_lowband_basis(H, W, threshold, x.device)
+    if basis is None or (not isinstance(scale, torch.Tensor) and float(scale) == 1.0):
+        return x
+
+    x32 = x.float()
+    lead = x32.shape[:-2]
+    k_h = basis["weight"].shape[0]
+    k_w = basis["weight"].shape[1]
+
+    # F_H[K] @ x @ F_W[K]^T, the band weights, then the inverse transform, all as real GEMMs over
+    # the flattened batch so the large products run as single matrix multiplies.
+    flat = x32.reshape(-1, H, W)
+    n = flat.shape[0]
+    a = basis["forward_h"] @ flat.transpose(0, 1).reshape(H, n * W)
+    p = a.reshape(2 * k_h * n, W) @ basis["forward_w"]
+    p = p.reshape(2, k_h, n, 2, k_w)
+    b_re = (p[0, :, :, 0] + p[1, :, :, 1]) * basis["weight"][:, None, :]
+    b_im = (p[1, :, :, 0] - p[0, :, :, 1]) * basis["weight"][:, None, :]
+    inverse_h = basis["inverse_h"]
+    d_re = inverse_h[:, :k_h] @ b_re.reshape(k_h, n * k_w) - inverse_h[:, k_h:] @ b_im.reshape(k_h, n * k_w)
+    d_im = inverse_h[:, :k_h] @ b_im.reshape(k_h, n * k_w) + inverse_h[:, k_h:] @ b_re.reshape(k_h, n * k_w)
+    d = torch.cat([d_re.reshape(H * n, k_w), d_im.reshape(H * n, k_w)], dim=1)
+    lowpass = (d @ basis["inverse_w"]).reshape(H, n, W).transpose(0, 1)
+
+    if isinstance(scale, torch.Tensor):
+        lowpass = lowpass.reshape(*lead, H, W) * (per_sample_scale(scale, x32) - 1.0)
+        return (x32 + lowpass).to(x.dtype)
+
+    out = flat + (float(scale) - 1.0) * lowpass
+    return out.reshape(*lead, H, W).to(x.dtype)
+
+
+def select_filter_backend(H, W, threshold):
+    # Rough flop model: the low-band path costs ~2 * (rows + cols) * H * W multiply-adds,
+    # rfft2 + irfft2 ~5 * H * W * log2(H * W).
+    band = min(2 * int(threshold) + 1, H) + min(2 * int(threshold) + 1, W)
+    if 2 * band <= 5 * math.log2(max(H * W, 2)):
+        return "lowband"
+    return "fft"
+
+
+def resolve_backend(H, W, threshold, backend="auto"):
+    if backend not in filter_backends or backend == "auto":
+        return select_filter_backend(H, W, threshold)
+    return backend
+
+
+# Peak bytes of temporaries per element of x for each backend, rounded up from what
+# extras/fum_benchmark.py measures for float32 and float16 inputs on 16x16 to 128x128 planes:
+# 8-10.5 B for fft, 12.6-21.3 B for lowband (its GEMM intermediates grow on small planes).
+filter_bytes_per_element = {"fft": 12, "lowband": 24}
+
+# Below this estimate the filter runs in one piece without asking the device for free memory.
+chunking_threshold = 64 * 2 ** 20
+
+
+def available_memory(device):
+    device = torch.device(device)
+    if device.type == "cuda":
+        # Memory the caching allocator has reserved but not handed out is free for the filter too.
+        free, _ = torch.cuda.mem_get_info(device)
+        return free + torch.cuda.memory_reserved(device) - torch.cuda.memory_allocated(device)
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def filter_chunks(x, backend, memory_budget=None):
+    # Index tuples over batch, then channels, whose temporaries fit the memory budget (bytes; None
+    # or 0 uses half the free memory of x's device), or None when the whole tensor fits. Every
+    # (sample, channel) plane is filtered on its own, so the slices give the same results.
+    if x.dim() != 4:
+        return None
+
+    B, C, H, W = x.shape
+    plane = H * W * filter_bytes_per_element.get(backend, 24)
+    needed = B * C * plane
+    if not memory_budget or memory_budget <= 0:
+        if needed <= chunking_threshold:
+            return None
+        free = available_memory(x.device)
+        if free is None:
+            return None
+        memory_budget = free // 2
+
+    planes = max(2, int(memory_budget) // plane)
+    if planes >= B * C:
+        return None
+
+    if planes >= C:
+        samples = planes // C
+        return [(slice(b, b + samples),) for b in range(0, B, samples)]
+
+    # Channel slices are spread evenly so none holds a single plane: a lone transform takes a
+    # different FFT code path than a batch of them and can differ in the last bit.
+    pieces = -(-C // planes)
+    bounds = [C * i // pieces for i in range(pieces + 1)]
+    return [(slice(b, b + 1), slice(bounds[i], bounds[i + 1])) for b in range(B) for i in range(pieces)]
+
+
+def filter_skip(x, threshold, scale, backend="auto", memory_budget=None):
+    backend = resolve_backend(x.shape[-2], x.shape[-1], threshold, backend)
+    run = lowband_filter if backend == "lowband" else fourier_filter
+
+    chunks = filter_chunks(x, backend, memory_budget)
+    if chunks is None:
+        return run(x, threshold, scale)
+
+    out = torch.empty_like(x)
+    for index in chunks:
+        chunk_scale = scale
+        if isinstance(scale, torch.Tensor) and scale.numel() > 1:
+            chunk_scale = scale[index[0]]
+        out[index] = run(x[index], threshold, chunk_scale)
+    return out
@@ -1,69 +1,28 @@
-import math
-import random
+import itertools
+import json
+import os
+import time
+import uuid
+from contextlib import closing
+from secrets import compare_digest
 
 import gradio as gr
 import torch
+from fastapi import Body, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
 
-from modules import scripts
-from modules.script_callbacks import on_cfg_denoiser, remove_current_script_callbacks
+from modules import errors, images, processing, scripts, shared
+from modules.call_queue import queue_lock
+from modules.script_callbacks import on_app_started, on_ui_settings
 from modules.ui_components import InputAccordion
 
+from lib_fum import backbone, instrument, motion, noise, prefix, schedule, sequence, spectral
+from lib_fum.patch import patch_FUM_v2
 
-def Fourier_filter(x, threshold, scale):
-    x_freq = torch.fft.fftn(x.float(), dim=(-2, -1))
-    x_freq = torch.fft.fftshift(x_freq, dim=(-2, -1))
-
-    B, C, H, W = x_freq.shape
-    mask = torch.ones((B, C, H, W), device=x.device)
-
-    crow, ccol = H // 2, W // 2
-    mask[..., crow - threshold:crow + threshold, ccol - threshold:ccol + threshold] = scale
-    x_freq = x_freq * mask
-
-    x_freq = torch.fft.ifftshift(x_freq, dim=(-2, -1))
-    x_filtered = torch.fft.ifftn(x_freq, dim=(-2, -1)).real
-
-    return x_filtered.to(x.dtype)
-
-
-def patch_FUM_v2(unet_patcher, b1, b2, s1, s2):
-    model_channels = unet_patcher.model.diffusion_model.config.get("model_channels")
-
-    scale_dict = {model_channels * 4: (b1, s1), model_channels * 2: (b2, s2)}
-    on_cpu_devices = {}
-
-    def output_block_patch(h, hsp, transformer_options):
-        process = FUMForForge.doFUM
-
-        if process:
-            scale = scale_dict.get(h.shape[1], None)
-            if scale is not None:
-                hidden_mean = h.mean(1).unsqueeze(1)
-                B = hidden_mean.shape[0]
-                hidden_max, _ = torch.max(hidden_mean.view(B, -1), dim=-1, keepdim=True)
-                hidden_min, _ = torch.min(hidden_mean.view(B, -1), dim=-1, keepdim=True)
-                denom = (hidden_max - hidden_min).unsqueeze(2).unsqueeze(3)
-                denom = torch.where(denom == 0, torch.ones_like(denom), denom)
-                hidden_mean = (hidden_mean - hidden_min.unsqueeze(2).unsqueeze(3)) / denom
-
-                h[:, :h.shape[1] // 2] = h[:, :h.shape[1] // 2] * ((scale[0] - 1) * hidden_mean + 1)
-
-                if hsp.device not in on_cpu_devices:
-                    try:
-                        hsp = Fourier_filter(hsp, threshold=1, scale=scale[1])
-                    except Exception:
-                        print("Device", hsp.device, "does not support the torch.fft functions used in the FUM node, switching to CPU.")
-                        on_cpu_devices[hsp.device] = True
-                        hsp = Fourier_filter(hsp.cpu(), threshold=1, scale=scale[1]).to(hsp.device)
-                else:
-                    hsp = Fourier_filter(hsp.cpu(), threshold=1, scale=scale[1]).to(hsp.device)
-
-        return h, hsp
-
-    m = unet_patcher.clone()
-    m.set_model_output_block_patch(output_block_patch)
-    return m
-
+# A sequence advances once per job. Jobs are told apart by this token rather than by id(p), which
+# CPython may hand to the next job once the previous one is freed.
+job_ids = itertools.count(1)
 
 def clamp_float(value, minimum, maximum, fallback=None):
     if fallback is None:
@@ -110,51 +69,27 @@ def normalize_bounds(lower, upper, hard_min, hard_max, default_lower=None, defau
     return lower, upper
 
 
-def triangle_wave(t):
-    t = float(t) % 1.0
-    return 1.0 - abs((2.0 * t) - 1.0)
+def per_frame_value(values):
+    # Infotext values are resolved per image; a callable receives the image's position in the batch.
+    values = list(values)
+
+    def value_for_image(position_in_batch=0, **kwargs):
+        return values[min(max(int(position_in_batch), 0), len(values) - 1)]
 
+    return value_for_image
 
-def cosine_ease(x):
-    x = clamp_float(x, 0.0, 1.0, 0.0)
-    return 0.5 - 0.5 * math.cos(x * math.pi)
+
+def resolve_infotext_value(value, position_in_batch=0):
+    return value(position_in_batch=position_in_batch) if callable(value) else value
 
 
 class FUMForForge(scripts.Script):
     sorting_priority = 12
 
-    doFUM = True
-    FUM_start = 0.0
-    FUM_end = 1.0
-
-    last_b1 = 1.01
-    last_b2 = 1.02
-    last_s1 = 0.99
-    last_s2 = 0.95
-
-    motion_presets = [
-        "Off",
-        "Random Step",
-        "Linear Up",
-        "Linear Down",
-        "YoYo",
-        "Wave",
-        "Triangle",
-        "Saw Up",
-        "Saw Down",
-        "Pulse Return",
-        "Ease In-Out",
-        "Square Hold",
-    ]
-    motion_state = {}
+    motion_presets = list(motion.motion_presets)
 
     prompt_stabilizer_default = "plain black backdrop pattern."
 
-    sequence_frame = 0
-    sequence_initialized = False
-    last_processing_id = None
-    sequence_signature = None
-
     presets_builtin = [
         ('Forge default', 1.01, 1.02, 0.99, 0.95, 0.0, 1.0),
         ('SD 1.4', 1.3, 1.4, 0.9, 0.2, 0.0, 1.0),
@@ -223,167 +158,194 @@ class FUMForForge(scripts.Script):
         if hasattr(p, "all_hr_prompts") and isinstance(p.all_hr_prompts, list):
             p.all_hr_prompts = [cls.append_prompt_text(prompt, addition_text) for prompt in p.all_hr_prompts]
 
-    @classmethod
-    def reset_motion_state(cls, name, origin, lower, upper, preset):
-        origin = clamp_float(origin, lower, upper, origin)
-        cls.motion_state[name] = {
-            "current": origin,
-            "direction": 1,
-            "origin": origin,
-            "lower": lower,
-            "upper": upper,
-            "preset": preset,
-        }
-        return cls.motion_state[name]
+    @staticmethod
+    def get_noise_key(p, rng):
+        return (
+            tuple(getattr(rng, "shape", ()) or ()),
+            tuple(getattr(p, "seeds", ()) or ()),
+            tuple(getattr(p, "subseeds", ()) or ()),
+            float(getattr(p, "subseed_strength", 0.0) or 0.0),
+            int(getattr(p, "seed_resize_from_h", 0) or 0),
+            int(getattr(p, "seed_resize_from_w", 0) or 0),
+            shared.opts.data.get("randn_source", None),
+            str(getattr(shared, "device", "")),
+        )
+
+    @staticmethod
+    def get_extra_network_key(p):
+        # The host strips <lora:...> and other extra network tags from p.prompts before sampling and
+        # keeps them, weights included, in extra_network_data.
+        data = getattr(p, "extra_network_data", None) or {}
+        return tuple(sorted(
+            (name, tuple(tuple(str(item) for item in getattr(params, "items", ()) or ()) for params in entries))
+            for name, entries in data.items()
+        ))
+
+    @staticmethod
+    def get_prefix_key(p, first_step):
+        # Everything that shapes the latent before FUM's first active step.
+        return (
+            FUMForForge.get_noise_key(p, getattr(p, "rng", None)),
+            tuple(getattr(p, "prompts", ()) or ()),
+            tuple(getattr(p, "negative_prompts", ()) or ()),
+            FUMForForge.get_extra_network_key(p),
+            p.sampler_name,
+            getattr(p, "scheduler", None),
+            p.steps,
+            p.cfg_scale,
+            getattr(p, "distilled_cfg_scale", None),
+            p.width,
+            p.height,
+            getattr(p, "sd_model_hash", None),
+            shared.opts.data.get("sd_model_checkpoint", None),
+            shared.opts.data.get("CLIP_stop_at_last_layers", None),
+            shared.opts.data.get("sgm_noise_multiplier", None),
+            first_step,
+        )
+
+    @staticmethod
+    def setup_prefix_cache(p, x, sequence_state, step_schedule):
+        # Steps before FUM's first active step are identical for every job of a sequence. The first
+        # job snapshots the latent there; later jobs copy it into their initial latent and sample
+        # only the rest of the schedule.
+        sampler = getattr(p, "sampler", None)
+        if x is None or sampler is None or not hasattr(sampler, "get_sigmas"):
+            return
+        if not isinstance(p, processing.StableDiffusionProcessingTxt2Img) or getattr(p, "is_hr_pass", False):
+            return
+        if p.sampler_name not in prefix.prefix_samplers or float(shared.opts.data.get("s_churn", 0.0) or 0.0) > 0.0:
+            return
+
+        strengths = schedule.compile_step_schedule(p.steps, *step_schedule)
+        first_step = next((step for step, strength in enumerate(strengths) if strength > 0.0), None)
+        if not first_step:
+            return
+
+        key = FUMForForge.get_prefix_key(p, first_step)
+        with sequence_state.lock:
+            snapshot = sequence_state.prefix_snapshot
+
+        sigmas = sampler.get_sigmas(p, p.steps)
+        if len(sigmas) <= first_step:
+            return
+
+        if snapshot is None or snapshot.key != key or snapshot.x.shape != x.shape:
+            if not hasattr(sampler, "callback_state"):
+                return
+
+            def store(snapshot):
+                with sequence_state.lock:
+                    sequence_state.prefix_snapshot = snapshot
+
+            capture = prefix.PrefixCapture(key, first_step, p.steps, sigmas[first_step], x.shape[0], store)
+            capture.arm(sampler)
+            schedule.progress.capture = capture
+            return
+
+        if not snapshot.matches_sigma(sigmas[snapshot.step]):
+            return
+
+        scale = prefix.resume_scale(snapshot.sigma, bool(shared.opts.data.get("sgm_noise_multiplier", False)))
+        x.copy_(snapshot.x.to(device=x.device, dtype=x.dtype) / scale)
+        prefix.truncate_sigmas(sampler, snapshot.step)
+        schedule.progress.offset = snapshot.step
+        schedule.progress.total_override = snapshot.total
 
     @classmethod
-    def get_sequence_frame(cls, p, start_frame, frame_step, auto_advance, reset_on_new_job):
+    def get_sequence_frame(cls, sequence_state, p, start_frame, frame_step, auto_advance, reset_on_new_job, frame_count=1, motion_seed=-1):
         start_frame = clamp_int(start_frame, 0, 100000000, 0)
         frame_step = clamp_int(frame_step, 1, 100000000, 1)
         auto_advance = bool(auto_advance)
         reset_on_new_job = bool(reset_on_new_job)
-        signature = (start_frame, frame_step, auto_advance, reset_on_new_job)
-        processing_id = id(p)
-
-        if cls.sequence_signature != signature:
-            cls.sequence_signature = signature
-            cls.sequence_frame = start_frame
-            cls.sequence_initialized = True
-            cls.last_processing_id = processing_id
-            cls.motion_state.clear()
-            return cls.sequence_frame
-
-        if not cls.sequence_initialized:
-            cls.sequence_frame = start_frame
-            cls.sequence_initialized = True
-            cls.last_processing_id = processing_id
-            cls.motion_state.clear()
-            return cls.sequence_frame
-
-        if cls.last_processing_id != processing_id:
+        motion_seed = clamp_int(motion_seed, -1, 4294967295, -1)
+        signature = (start_frame, frame_step, auto_advance, reset_on_new_job, motion_seed)
+        processing_id = getattr(p, "fum_job_id", None) or id(p)
+
+        if sequence_state.signature != signature:
+            sequence_state.signature = signature
+            sequence_state.frame = start_frame
+            sequence_state.initialized = True
+            sequence_state.last_processing_id = processing_id
+            sequence_state.reset_motion(motion_seed)
+            sequence_state.frame_count = max(1, int(frame_count))
+            return sequence_state.frame
+
+        if not sequence_state.initialized:
+            sequence_state.frame = start_frame
+            sequence_state.initialized = True
+            sequence_state.last_processing_id = processing_id
+            sequence_state.reset_motion(motion_seed)
+            sequence_state.frame_count = max(1, int(frame_count))
+            return sequence_state.frame
+
+        if sequence_state.last_processing_id != processing_id:
             if reset_on_new_job:
-                cls.sequence_frame = start_frame
-                cls.motion_state.clear()
+                sequence_state.frame = start_frame
+                sequence_state.reset_motion(motion_seed)
             elif auto_advance:
-                cls.sequence_frame += frame_step
+                sequence_state.frame += frame_step * sequence_state.frame_count
+                sequence_state.position += sequence_state.frame_count
             else:
-                cls.sequence_frame = start_frame
-                cls.motion_state.clear()
-            cls.last_processing_id = processing_id
+                sequence_state.frame = start_frame
+                sequence_state.reset_motion(motion_seed)
+            sequence_state.last_processing_id = processing_id
 
-        return clamp_int(cls.sequence_frame, 0, 100000000, 0)
+        sequence_state.frame_count = max(1, int(frame_count))
+        return clamp_int(sequence_state.frame, 0, 100000000, 0)
 
     @staticmethod
-    def get_period_position(frame_index, motion_speed, cycle_frames, phase_offset):
-        frame_index = clamp_int(frame_index, 0, 100000000, 0)
-        motion_speed = clamp_float(motion_speed, 0.1, 10.0, 1.0)
-        cycle_frames = clamp_int(cycle_frames, 1, 100000, 60)
-        phase_offset = clamp_float(phase_offset, 0.0, 1.0, 0.0)
-        return (((frame_index * motion_speed) / float(cycle_frames)) + phase_offset) % 1.0
+    def get_checkpoint_path(p, sequence_id):
+        directory = getattr(p, "outpath_samples", None) or "."
+        return sequence.checkpoint_path(directory, sequence_id)
 
     @classmethod
-    def get_motion_value(cls, name, base_value, step_size, motion_speed, lower, upper, preset, frame_index, cycle_frames, phase_offset):
-        base_value = clamp_float(base_value, lower, upper, base_value)
-
-        if preset == "Off" or upper <= lower:
-            cls.reset_motion_state(name, base_value, lower, upper, preset)
-            return base_value
+    def script_arg_defaults(cls):
+        # Script arguments in the order ui() returns its components, used to build args headlessly.
+        defaults = [("enabled", False)]
+        for name in motion.param_names:
+            meta = cls.param_meta[name]
+            defaults += [
+                (name, meta["default"]),
+                (f"{name}_preset", "Off"),
+                (f"{name}_step", 0.01),
+                (f"{name}_step_number", None),
+                (f"{name}_speed", 1.0),
+                (f"{name}_speed_number", None),
+                (f"{name}_min", meta["minimum"]),
+                (f"{name}_min_number", None),
+                (f"{name}_max", meta["maximum"]),
+                (f"{name}_max_number", None),
+                (f"{name}_cycle", 60),
+                (f"{name}_cycle_number", None),
+                (f"{name}_phase", 0.0),
+                (f"{name}_phase_number", None),
+            ]
+        defaults += [
+            ("start", 0.0),
+            ("end", 1.0),
+            ("sequence_start", 0),
+            ("sequence_step", 1),
+            ("sequence_auto_advance", True),
+            ("sequence_reset_on_new_job", False),
+            ("prompt_stabilizer_enabled", False),
+            ("prompt_stabilizer_text", cls.prompt_stabilizer_default),
+            ("sequence_batch", False),
+            ("ramp_in", 0.0),
+            ("ramp_out", 0.0),
+            ("ramp_curve", "Linear"),
+            ("sequence_id", ""),
+            ("motion_seed", -1),
+            ("sequence_resume", False),
+        ]
+        return defaults
 
-        state = cls.motion_state.get(name)
-        if state is None:
-            state = cls.reset_motion_state(name, base_value, lower, upper, preset)
-        else:
-            if (
-                state.get("preset") != preset
-                or abs(state.get("origin", base_value) - base_value) > 1e-12
-                or abs(state.get("lower", lower) - lower) > 1e-12
-                or abs(state.get("upper", upper) - upper) > 1e-12
-            ):
-                state = cls.reset_motion_state(name, base_value, lower, upper, preset)
-
-        step_size = clamp_float(step_size, 0.0001, 0.1, 0.01)
-        motion_speed = clamp_float(motion_speed, 0.1, 10.0, 1.0)
-        cycle_frames = clamp_int(cycle_frames, 1, 100000, 60)
-        phase_offset = clamp_float(phase_offset, 0.0, 1.0, 0.0)
-        effective_step = max(0.0001, step_size * motion_speed)
-        origin = clamp_float(base_value, lower, upper, base_value)
-        span = upper - lower
-
-        if preset == "Random Step":
-            current = state["current"] + random.choice([-effective_step, effective_step])
-            current = clamp_float(current, lower, upper, origin)
-            state["current"] = current
-            return current
-
-        if preset == "Linear Up":
-            current = origin + (effective_step * frame_index)
-            current = clamp_float(current, lower, upper, origin)
-            state["current"] = current
-            return current
-
-        if preset == "Linear Down":
-            current = origin - (effective_step * frame_index)
-            current = clamp_float(current, lower, upper, origin)
-            state["current"] = current
-            return current
-
-        if preset == "YoYo":
-            current = state["current"] + (state["direction"] * effective_step)
-            if current >= upper:
-                current = upper
-                state["direction"] = -1
-            elif current <= lower:
-                current = lower
-                state["direction"] = 1
-            state["current"] = current
-            return current
-
-        t = cls.get_period_position(frame_index, motion_speed, cycle_frames, phase_offset)
-
-        if preset == "Wave":
-            normalized = 0.5 + 0.5 * math.sin((2.0 * math.pi * t) - (math.pi / 2.0))
-            current = lower + (span * normalized)
-            state["current"] = current
-            return clamp_float(current, lower, upper, origin)
-
-        if preset == "Triangle":
-            normalized = triangle_wave(t)
-            current = lower + (span * normalized)
-            state["current"] = current
-            return clamp_float(current, lower, upper, origin)
-
-        if preset == "Saw Up":
-            normalized = t
-            current = lower + (span * normalized)
-            state["current"] = current
-            return clamp_float(current, lower, upper, origin)
-
-        if preset == "Saw Down":
-            normalized = 1.0 - t
-            current = lower + (span * normalized)
-            state["current"] = current
-            return clamp_float(current, lower, upper, origin)
-
-        if preset == "Pulse Return":
-            target = upper if abs(upper - origin) >= abs(origin - lower) else lower
-            normalized = cosine_ease(triangle_wave(t))
-            current = origin + ((target - origin) * normalized)
-            state["current"] = current
-            return clamp_float(current, lower, upper, origin)
-
-        if preset == "Ease In-Out":
-            normalized = cosine_ease(triangle_wave(t))
-            current = lower + (span * normalized)
-            state["current"] = current
-            return clamp_float(current, lower, upper, origin)
-
-        if preset == "Square Hold":
-            normalized = 1.0 if t < 0.5 else 0.0
-            current = lower + (span * normalized)
-            state["current"] = current
-            return clamp_float(current, lower, upper, origin)
-
-        return base_value
+    @classmethod
+    def build_script_args(cls, settings):
+        defaults = cls.script_arg_defaults()
+        unknown = set(settings) - {name for name, _ in defaults}
+        if unknown:
+            raise ValueError(f"unknown FUM settings: {', '.join(sorted(unknown))}")
+        return [settings.get(name, default) for name, default in defaults]
 
     def ui(self, *args, **kwargs):
         def sync_slider_to_number(minimum, maximum, digits=4):
@@ -484,6 +446,10 @@ class FUMForForge(scripts.Script):
             with gr.Row():
                 FUM_start = gr.Slider(label='Start step', minimum=0.0, maximum=1.0, step=0.01, value=0.0)
                 FUM_end = gr.Slider(label='End step', minimum=0.0, maximum=1.0, step=0.01, value=1.0)
+            with gr.Row():
+                FUM_ramp_in = gr.Slider(label='Ramp in', minimum=0.0, maximum=1.0, step=0.01, value=0.0)
+                FUM_ramp_out = gr.Slider(label='Ramp out', minimum=0.0, maximum=1.0, step=0.01, value=0.0)
+                FUM_ramp_curve = gr.Dropdown(label='Ramp curve', choices=list(schedule.ramp_curves), value="Linear")
             with gr.Row():
                 FUM_preset = gr.Dropdown(label='', choices=[x[0] for x in FUMForForge.presets], value='(presets)', type='index', scale=0, allow_custom_value=True)
             with gr.Row():
@@ -491,6 +457,12 @@ class FUMForForge(scripts.Script):
                 sequence_step = gr.Number(label="Sequence frame step", value=1, precision=0)
                 sequence_auto_advance = gr.Checkbox(label="Auto advance sequence frame", value=True)
                 sequence_reset_on_new_job = gr.Checkbox(label="Reset to start frame on new job", value=False)
+            with gr.Row():
+                sequence_id = gr.Textbox(label="Sequence ID", value="", placeholder=sequence.default_sequence_id, lines=1)
+                sequence_batch = gr.Checkbox(label="Render batch as consecutive frames", value=False)
+            with gr.Row():
+                motion_seed = gr.Number(label="Motion seed (-1 = random)", value=-1, precision=0)
+                sequence_resume = gr.Checkbox(label="Resume sequence from checkpoint", value=False)
             with gr.Row():
                 prompt_stabilizer_enabled = gr.Checkbox(label="Append prompt stabilizer text", value=False)
             with gr.Row():
@@ -566,6 +538,12 @@ class FUMForForge(scripts.Script):
             (sequence_reset_on_new_job, lambda d: d.get("FUM_sequence_reset_on_new_job", False)),
             (prompt_stabilizer_enabled, lambda d: d.get("FUM_prompt_stabilizer_enabled", False)),
             (prompt_stabilizer_text, "FUM_prompt_stabilizer_text"),
+            (sequence_batch, lambda d: d.get("FUM_sequence_batch", False)),
+            (FUM_ramp_in, "FUM_ramp_in"),
+            (FUM_ramp_out, "FUM_ramp_out"),
+            (FUM_ramp_curve, "FUM_ramp_curve"),
+            (sequence_id, "FUM_sequence_id"),
+            (motion_seed, "FUM_motion_seed"),
         ]
 
         return (
@@ -577,15 +555,54 @@ class FUMForForge(scripts.Script):
             FUM_start, FUM_end,
             sequence_start, sequence_step, sequence_auto_advance, sequence_reset_on_new_job,
             prompt_stabilizer_enabled, prompt_stabilizer_text,
+            sequence_batch,
+            FUM_ramp_in, FUM_ramp_out, FUM_ramp_curve,
+            sequence_id,
+            motion_seed, sequence_resume,
         )
 
-    def denoiser_callback(self, params):
-        if params.total_sampling_steps <= 1:
-            thisStep = 0.0
-        else:
-            thisStep = params.sampling_step / (params.total_sampling_steps - 1)
+    def process(self, p, *script_args, **kwargs):
+        FUM_enabled, *_, prompt_stabilizer_enabled, prompt_stabilizer_text, sequence_batch, FUM_ramp_in, FUM_ramp_out, FUM_ramp_curve, sequence_id, motion_seed, sequence_resume = script_args
+
+        if not FUM_enabled:
+            return
+
+        if getattr(p, "fum_job_id", None) is None:
+            p.fum_job_id = next(job_ids)
+
+        # Prompts are final before the conditioning is encoded, so the stabilizer text is part of
+        # the conditioning key and is appended once per job.
+        FUMForForge.apply_prompt_stabilizer(p, prompt_stabilizer_enabled, prompt_stabilizer_text)
+
+        if not sequence_batch:
+            return
+
+        # Every latent of a batch is one frame of the same animation, so they all share the seed
+        # of the first image in that batch.
+        batch_size = max(1, int(getattr(p, "batch_size", 1) or 1))
+        for attr in ("all_seeds", "all_subseeds"):
+            values = getattr(p, attr, None)
+            if isinstance(values, list) and values:
+                setattr(p, attr, [values[(i // batch_size) * batch_size] for i in range(len(values))])
 
-        FUMForForge.doFUM = FUMForForge.FUM_start <= thisStep <= FUMForForge.FUM_end
+    def process_batch(self, p, *script_args, **kwargs):
+        FUM_enabled, *_, sequence_id, motion_seed, sequence_resume = script_args
+
+        # Timings cover the whole batch, hires pass included.
+        instrument.stats.enabled = bool(FUM_enabled and shared.opts.data.get("fum_instrumentation", False))
+        if instrument.stats.enabled:
+            instrument.stats.reset()
+
+        if not FUM_enabled or not shared.opts.data.get("fum_reuse_conditioning", True):
+            return
+
+        rng = getattr(p, "rng", None)
+        if rng is None or not hasattr(rng, "next") or isinstance(rng, noise.NoiseReplay):
+            return
+
+        noise_cache = sequence.sequence_states.get(sequence_id).noise_cache
+        draws = noise_cache.record(FUMForForge.get_noise_key(p, rng))
+        p.rng = noise.NoiseReplay(rng, draws, noise_cache.draws_per_key)
 
     def process_before_every_sampling(self, p, *script_args, **kwargs):
         (
@@ -597,20 +614,20 @@ class FUMForForge(scripts.Script):
             FUM_start, FUM_end,
             sequence_start, sequence_step, sequence_auto_advance, sequence_reset_on_new_job,
             prompt_stabilizer_enabled, prompt_stabilizer_text,
+            sequence_batch,
+            FUM_ramp_in, FUM_ramp_out, FUM_ramp_curve,
+            sequence_id,
+            motion_seed, sequence_resume,
         ) = script_args
 
         if not FUM_enabled:
             return
 
-        FUMForForge.apply_prompt_stabilizer(p, prompt_stabilizer_enabled, prompt_stabilizer_text)
+        frame_count = max(1, int(getattr(p, "batch_size", 1) or 1)) if sequence_batch else 1
+        frame_step = clamp_int(sequence_step, 1, 100000000, 1)
 
-        frame_index = FUMForForge.get_sequence_frame(
-            p,
-            sequence_start,
-            sequence_step,
-            sequence_auto_advance,
-            sequence_reset_on_new_job,
-        )
+        sequence_id = sequence.normalize_sequence_id(sequence_id)
+        sequence_state = sequence.sequence_states.get(sequence_id)
 
         configs = {
             "b1": {
@@ -668,23 +685,36 @@ class FUMForForge(scripts.Script):
             cfg["cycle"] = clamp_int(cfg["cycle"], 1, 100000, 60)
             cfg["phase"] = clamp_float(cfg["phase"], 0.0, 1.0, 0.0)
 
-            cfg["value"] = FUMForForge.get_motion_value(
-                name=name,
-                base_value=cfg["value"],
-                step_size=cfg["step"],
-                motion_speed=cfg["speed"],
-                lower=lower,
-                upper=upper,
-                preset=cfg["preset"],
-                frame_index=frame_index,
-                cycle_frames=cfg["cycle"],
-                phase_offset=cfg["phase"],
+        with sequence_state.lock:
+            if sequence_resume and not sequence_state.initialized:
+                checkpoint = sequence.load_checkpoint(FUMForForge.get_checkpoint_path(p, sequence_id))
+                if checkpoint is not None:
+                    sequence_state.restore_checkpoint(checkpoint)
+                    print(f"FUM: resuming sequence '{sequence_id}' after frame {sequence_state.frame}.")
+
+            frame_index = FUMForForge.get_sequence_frame(
+                sequence_state,
+                p,
+                sequence_start,
+                sequence_step,
+                sequence_auto_advance,
+                sequence_reset_on_new_job,
+                frame_count,
+                motion_seed,
             )
-
-        FUMForForge.last_b1 = configs["b1"]["value"]
-        FUMForForge.last_b2 = configs["b2"]["value"]
-        FUMForForge.last_s1 = configs["s1"]["value"]
-        FUMForForge.last_s2 = configs["s2"]["value"]
+            frame_indices = [frame_index + (i * frame_step) for i in range(frame_count)]
+            frame_values = sequence_state.motion_values(configs, frame_index, frame_step, frame_count)
+            sequence_position = sequence_state.position
+            sequence_motion_seed = sequence_state.motion_seed
+
+        if frame_count > 1:
+            frame_params = torch.tensor(
+                [[frame_values[name][i] for name in ("b1", "b2", "s1", "s2")] for i in range(frame_count)],
+                dtype=torch.float32,
+            )
+            patch_params = [frame_params[:, i] for i in range(4)]
+        else:
+            patch_params = [frame_values[name][0] for name in ("b1", "b2", "s1", "s2")]
 
         unet = p.sd_model.forge_objects.unet
         model_channels = unet.model.diffusion_model.config.get("model_channels")
@@ -692,29 +722,56 @@ class FUMForForge(scripts.Script):
             gr.Info("FUM is not supported for this model!")
             return
 
-        FUMForForge.FUM_start = clamp_float(FUM_start, 0.0, 1.0, 0.0)
-        FUMForForge.FUM_end = clamp_float(FUM_end, 0.0, 1.0, 1.0)
-        if FUMForForge.FUM_start > FUMForForge.FUM_end:
-            FUMForForge.FUM_start, FUMForForge.FUM_end = FUMForForge.FUM_end, FUMForForge.FUM_start
+        FUM_start = clamp_float(FUM_start, 0.0, 1.0, 0.0)
+        FUM_end = clamp_float(FUM_end, 0.0, 1.0, 1.0)
+        if FUM_start > FUM_end:
+            FUM_start, FUM_end = FUM_end, FUM_start
 
-        on_cfg_denoiser(self.denoiser_callback)
+        FUM_ramp_in = clamp_float(FUM_ramp_in, 0.0, 1.0, 0.0)
+        FUM_ramp_out = clamp_float(FUM_ramp_out, 0.0, 1.0, 0.0)
+        if FUM_ramp_curve not in schedule.ramp_curves:
+            FUM_ramp_curve = "Linear"
+        schedule.progress.reset()
 
         unet = patch_FUM_v2(
             unet,
-            FUMForForge.last_b1,
-            FUMForForge.last_b2,
-            FUMForForge.last_s1,
-            FUMForForge.last_s2,
+            *patch_params,
+            filter_backend=shared.opts.data.get("fum_filter_backend", "auto"),
+            step_schedule=(FUM_start, FUM_end, FUM_ramp_in, FUM_ramp_out, FUM_ramp_curve),
+            backbone_kernel=shared.opts.data.get("fum_backbone_kernel", "eager"),
+            filter_memory_budget=clamp_int(shared.opts.data.get("fum_filter_memory_budget", 0), 0, 1048576, 0) * 2 ** 20,
         )
 
         p.sd_model.forge_objects.unet = unet
 
+        if shared.opts.data.get("fum_prefix_cache", True):
+            FUMForForge.setup_prefix_cache(
+                p,
+                kwargs.get("x"),
+                sequence_state,
+                (FUM_start, FUM_end, FUM_ramp_in, FUM_ramp_out, FUM_ramp_curve),
+            )
+
+        # The patch works out the sampling step from the sigma of each UNet call; there is no
+        # per-step callback for generations with FUM off.
+        total_steps = p.steps
+        if getattr(p, "is_hr_pass", False):
+            total_steps = getattr(p, "hr_second_pass_steps", 0) or p.steps
+        schedule.progress.follow(getattr(p, "sampler", None), total_steps)
+
+        if frame_count > 1:
+            infotext_values = {name: per_frame_value(values) for name, values in frame_values.items()}
+            infotext_frame = per_frame_value(frame_indices)
+        else:
+            infotext_values = {name: values[0] for name, values in frame_values.items()}
+            infotext_frame = frame_index
+
         p.extra_generation_params.update(dict(
             FUM_enabled=FUM_enabled,
-            FUM_b1=FUMForForge.last_b1,
-            FUM_b2=FUMForForge.last_b2,
-            FUM_s1=FUMForForge.last_s1,
-            FUM_s2=FUMForForge.last_s2,
+            FUM_b1=infotext_values["b1"],
+            FUM_b2=infotext_values["b2"],
+            FUM_s1=infotext_values["s1"],
+            FUM_s2=infotext_values["s2"],
             FUM_b1_preset=FUM_b1_preset,
             FUM_b2_preset=FUM_b2_preset,
             FUM_s1_preset=FUM_s1_preset,
@@ -743,17 +800,286 @@ class FUMForForge(scripts.Script):
             FUM_b2_phase=configs["b2"]["phase"],
             FUM_s1_phase=configs["s1"]["phase"],
             FUM_s2_phase=configs["s2"]["phase"],
-            FUM_start=FUMForForge.FUM_start,
-            FUM_end=FUMForForge.FUM_end,
-            FUM_sequence_frame=frame_index,
+            FUM_start=FUM_start,
+            FUM_end=FUM_end,
+            FUM_ramp_in=FUM_ramp_in,
+            FUM_ramp_out=FUM_ramp_out,
+            FUM_ramp_curve=FUM_ramp_curve,
+            FUM_sequence_frame=infotext_frame,
             FUM_sequence_start=clamp_int(sequence_start, 0, 100000000, 0),
             FUM_sequence_step=clamp_int(sequence_step, 1, 100000000, 1),
             FUM_sequence_auto_advance=bool(sequence_auto_advance),
             FUM_sequence_reset_on_new_job=bool(sequence_reset_on_new_job),
             FUM_prompt_stabilizer_enabled=bool(prompt_stabilizer_enabled),
             FUM_prompt_stabilizer_text=str(prompt_stabilizer_text or "").strip(),
+            FUM_sequence_batch=bool(sequence_batch),
+            FUM_sequence_id=sequence_id,
+            FUM_sequence_position=sequence_position,
+            FUM_motion_seed=sequence_motion_seed,
         ))
 
-    def postprocess(self, params, processed, *args):
-        remove_current_script_callbacks()
+    def postprocess_batch(self, p, *script_args, **kwargs):
+        FUM_enabled, *_, sequence_id, motion_seed, sequence_resume = script_args
+
+        # A job interrupted before the capture step leaves it armed on its own sampler.
+        if schedule.progress.capture is not None:
+            schedule.progress.capture.disarm()
+            schedule.progress.capture = None
+
+        stats = instrument.stats
+        if not FUM_enabled or not stats.enabled:
+            return
+
+        summary = stats.summary()
+        stats.enabled = False
+        p.extra_generation_params.update(dict(
+            FUM_calls=summary["calls"],
+            FUM_time_ms=round(summary["fum_ms"], 1),
+            FUM_time_share=round(summary["fum_share"], 4),
+            FUM_fft_fallbacks=summary["fft_offloads"] + summary["fft_fallbacks"],
+            FUM_bytes_moved=summary["bytes_moved"],
+        ))
+
+        frame = p.extra_generation_params.get("FUM_sequence_frame")
+        batch_size = max(1, int(getattr(p, "batch_size", 1) or 1))
+        record = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "sequence_id": sequence.normalize_sequence_id(sequence_id),
+            "batch_number": kwargs.get("batch_number"),
+            "frames": [resolve_infotext_value(frame, i) for i in range(batch_size)],
+            "seeds": list(getattr(p, "seeds", []) or []),
+            "steps": p.steps,
+            "width": p.width,
+            "height": p.height,
+            "sampler": p.sampler_name,
+            **summary,
+        }
+        try:
+            instrument.append_log(os.path.join(p.outpath_samples, "fum_stats.jsonl"), record)
+        except OSError as e:
+            print(f"FUM: could not write the stats log: {e}")
+
+    def postprocess(self, p, processed, *script_args):
+        FUM_enabled, *_, sequence_batch, FUM_ramp_in, FUM_ramp_out, FUM_ramp_curve, sequence_id, motion_seed, sequence_resume = script_args
+
+        if not FUM_enabled:
+            return
+
+        # Checkpoint after the job's frames are finished, so a resume continues with the next frame.
+        sequence_id = sequence.normalize_sequence_id(sequence_id)
+        sequence_state = sequence.sequence_states.get(sequence_id)
+        with sequence_state.lock:
+            if not sequence_state.initialized:
+                return
+            checkpoint = sequence_state.to_checkpoint()
+
+        try:
+            sequence.save_checkpoint(FUMForForge.get_checkpoint_path(p, sequence_id), checkpoint)
+        except OSError as e:
+            print(f"FUM: could not write the sequence checkpoint: {e}")
+
+
+def get_api_dependencies():
+    # Same credentials check as the webui's own API routes (--api-auth user:password,...).
+    if not shared.cmd_opts.api_auth:
+        return []
+
+    credentials = dict(item.split(":", 1) for item in shared.cmd_opts.api_auth.split(","))
+
+    def auth(login: HTTPBasicCredentials = Depends(HTTPBasic())):
+        if login.username in credentials and compare_digest(login.password, credentials[login.username]):
+            return True
+        raise HTTPException(status_code=401, detail="Incorrect username or password", headers={"WWW-Authenticate": "Basic"})
+
+    return [Depends(auth)]
+
+
+def fum_api(_, app):
+    # Registered like the webui's API: only with --api (or --nowebui) and behind --api-auth.
+    if not (getattr(shared.cmd_opts, "api", False) or getattr(shared.cmd_opts, "nowebui", False)):
         return
+
+    @app.post("/fum/sequence", dependencies=get_api_dependencies())
+    def fum_sequence_api(request: dict = Body(...)):
+        # Renders a whole FUM sequence server-side and streams one JSON line per finished job.
+        runner = scripts.scripts_txt2img
+        script = next((s for s in runner.alwayson_scripts if isinstance(s, FUMForForge)), None)
+        if script is None:
+            raise HTTPException(status_code=404, detail="FUM script is not loaded for txt2img")
+
+        txt2img = dict(request.get("txt2img") or {})
+        frames = clamp_int(request.get("frames", 1), 1, 1000000, 1)
+        sequence_id = sequence.normalize_sequence_id(request.get("sequence_id") or f"api-{uuid.uuid4().hex[:12]}")
+        resume = bool(request.get("resume", False))
+
+        settings = dict(request.get("fum") or {})
+        settings.update(
+            enabled=True,
+            sequence_id=sequence_id,
+            sequence_start=request.get("start", settings.get("sequence_start", 0)),
+            sequence_step=request.get("step", settings.get("sequence_step", 1)),
+            sequence_auto_advance=True,
+            sequence_reset_on_new_job=False,
+            sequence_resume=resume,
+        )
+        try:
+            fum_args = FUMForForge.build_script_args(settings)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+        script_args = [getattr(component, "value", None) for component in runner.inputs]
+        script_args += [None] * max(0, script.args_to - len(script_args))
+        if script_args:
+            script_args[0] = 0
+        script_args[script.args_from:script.args_to] = fum_args
+
+        def create_processing():
+            p = processing.StableDiffusionProcessingTxt2Img(
+                sd_model=shared.sd_model,
+                outpath_samples=shared.opts.outdir_samples or shared.opts.outdir_txt2img_samples,
+                outpath_grids=shared.opts.outdir_grids or shared.opts.outdir_txt2img_grids,
+                **txt2img,
+            )
+            p.scripts = runner
+            p.script_args = list(script_args)
+            p.fum_job_id = next(job_ids)
+            p.do_not_save_samples = True
+            p.do_not_save_grid = True
+            p.is_api = True
+            return p
+
+        try:
+            first = create_processing()
+        except TypeError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+        if not resume:
+            sequence.sequence_states.discard(sequence_id)
+
+        def render_job(p):
+            with closing(p), queue_lock:
+                shared.state.begin(job="fum_sequence")
+                try:
+                    processed = processing.process_images(p)
+                    interrupted = shared.state.interrupted
+                finally:
+                    shared.state.end()
+
+            files = []
+            start = processed.index_of_first_image
+            for i, image in enumerate(processed.images[start:]):
+                infotext = processed.infotexts[start + i] if start + i < len(processed.infotexts) else None
+                fullfn, _ = images.save_image(
+                    image,
+                    p.outpath_samples,
+                    "",
+                    processed.all_seeds[i] if i < len(processed.all_seeds) else processed.seed,
+                    processed.all_prompts[i] if i < len(processed.all_prompts) else processed.prompt,
+                    shared.opts.samples_format,
+                    info=infotext,
+                    p=p,
+                )
+                files.append(fullfn)
+            return files, interrupted
+
+        def render():
+            # The response has started by the time a job runs, so a failed job ends the stream with
+            # an error record instead of an HTTP error.
+            p = first
+            try:
+                for index in range(frames):
+                    try:
+                        if p is None:
+                            p = create_processing()
+                        files, interrupted = render_job(p)
+                    except Exception as e:
+                        errors.report(f"FUM sequence {sequence_id} failed at job {index}", exc_info=True)
+                        yield json.dumps({"sequence_id": sequence_id, "job": index, "error": str(e)}) + "\n"
+                        return
+
+                    params = p.extra_generation_params
+                    yield json.dumps({
+                        "sequence_id": sequence_id,
+                        "job": index,
+                        "jobs": frames,
+                        "files": files,
+                        "frames": [
+                            {key: resolve_infotext_value(params.get(f"FUM_{key}"), i) for key in ("sequence_frame", *motion.param_names)}
+                            for i in range(len(files))
+                        ],
+                        "progress": (index + 1) / frames,
+                    }) + "\n"
+
+                    p = None
+                    if interrupted:
+                        break
+
+                yield json.dumps({"sequence_id": sequence_id, "done": True}) + "\n"
+            finally:
+                # Frees the cached noise and prefix latent when the stream ends, fails or is dropped
+                # by the client; a later job of the sequence rebuilds them on a miss.
+                sequence.sequence_states.release_caches(sequence_id)
+
+        return StreamingResponse(render(), media_type="application/x-ndjson")
+
+
+def fum_ui_settings():
+    section = ("fum", "FUM (FreeU-Move)")
+    shared.opts.add_option(
+        "fum_filter_backend",
+        shared.OptionInfo(
+            "auto",
+            "Skip connection filter backend",
+            gr.Radio,
+            {"choices": list(spectral.filter_backends)},
+            section=section,
+        ).info("auto = low-band DFT matmuls for small thresholds, FFT otherwise; low-band also runs on devices without torch.fft"),
+    )
+    shared.opts.add_option(
+        "fum_filter_memory_budget",
+        shared.OptionInfo(
+            0,
+            "Skip connection filter memory budget (MB)",
+            gr.Slider,
+            {"minimum": 0, "maximum": 16384, "step": 64},
+            section=section,
+        ).info("0 = automatic (half the free device memory); larger skip tensors are filtered in batch/channel slices with identical results"),
+    )
+    shared.opts.add_option(
+        "fum_backbone_kernel",
+        shared.OptionInfo(
+            "eager",
+            "Backbone scaling kernel",
+            gr.Radio,
+            {"choices": list(backbone.backbone_kernels)},
+            section=section,
+        ).info("low_memory scales in place without full-size temporaries; torchscript and compile fuse the backbone scaling into fewer kernels and fall back to eager if they fail; torchscript matches eager exactly, compile (Inductor reorders the reductions) to float rounding"),
+    )
+    shared.opts.add_option(
+        "fum_instrumentation",
+        shared.OptionInfo(
+            False,
+            "Record FUM hot-path timings",
+            section=section,
+        ).info("adds call counts, time and CPU FFT fallbacks to the infotext and appends a line per batch to fum_stats.jsonl in the output folder"),
+    )
+    shared.opts.add_option(
+        "fum_reuse_conditioning",
+        shared.OptionInfo(
+            True,
+            "Reuse initial noise across the jobs of a sequence",
+            section=section,
+        ).info("prompt conditioning is already reused by the host's own cache while the prompt stays the same"),
+    )
+    shared.opts.add_option(
+        "fum_prefix_cache",
+        shared.OptionInfo(
+            True,
+            "Resume sequence jobs from the latent at FUM's start step",
+            section=section,
+        ).info("txt2img with Euler only; assumes other extensions change nothing between the jobs of a sequence"),
+    )
+
+
+on_app_started(fum_api)
+on_ui_settings(fum_ui_settings)
@@ -0,0 +1,55 @@
+import pytest
+import torch
+
+from lib_fum import backbone
+
+
+def sample(shape, dtype):
+    generator = torch.Generator().manual_seed(shape[0] * 31 + shape[1])
+    return torch.randn(shape, generator=generator).to(dtype)
+
+
+# Per-sample scales reach the kernels in h's dtype, shaped (B, 1, 1, 1), as the output block patch
+# passes them.
+scales = [1.3, 0.7, (1.1, 0.9, 1.5)]
+
+
+def run_kernel(kernel, dtype, scale):
+    h = sample((3, 8, 12, 10), dtype)
+    if isinstance(scale, tuple):
+        scale = torch.tensor(scale, dtype=dtype).view(-1, 1, 1, 1)
+    expected = backbone.scale_backbone(h.clone(), scale)
+    return backbone.kernels.run(kernel, h.clone(), scale), expected
+
+
+@pytest.mark.parametrize("kernel", ["low_memory", "torchscript"])
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float16])
+@pytest.mark.parametrize("scale", scales)
+def test_kernels_match_eager_on_cpu(kernel, dtype, scale):
+    result, expected = run_kernel(kernel, dtype, scale)
+    assert (kernel, "cpu") not in backbone.kernels.failed
+    assert torch.equal(result, expected)
+
+
+@pytest.fixture(scope="module")
+def compiler():
+    try:
+        torch.compile(lambda x: x + 1)(torch.zeros(2))
+    except Exception as e:
+        pytest.skip(f"torch.compile is not available: {e}")
+
+
+# Inductor reorders the reductions, so the compiled kernel matches eager to float rounding.
+@pytest.mark.parametrize("dtype, tolerance", [(torch.float32, 1e-5), (torch.float16, 2e-3)])
+@pytest.mark.parametrize("scale", scales)
+def test_compiled_kernel_matches_eager_on_cpu(compiler, dtype, tolerance, scale):
+    result, expected = run_kernel("compile", dtype, scale)
+    assert ("compile", "cpu") not in backbone.kernels.failed
+    torch.testing.assert_close(result, expected, rtol=tolerance, atol=tolerance)
+
+
+def test_constant_mean_is_not_divided_by_zero():
+    h = torch.ones((2, 4, 6, 6))
+    for kernel in backbone.backbone_kernels:
+        result = backbone.kernels.run(kernel, h.clone(), 1.5)
+        assert torch.equal(result, backbone.scale_backbone(h.clone(), 1.5))
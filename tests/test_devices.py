@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+import torch
+
+from lib_fum import devices, patch, spectral
+
+
+def test_offload_threads_do_not_share_buffers():
+    offload = devices.CpuFilterOffload(max_workers=2, buffer_limit=3)
+    inputs = [torch.randn(2, 4, 16, 16) * (i + 1) for i in range(6)]
+    expected = [spectral.filter_skip(x, 1, 0.7, "fft") for x in inputs]
+    mismatches = []
+
+    def job(i):
+        for _ in range(10):
+            if not torch.equal(offload.run(inputs[i], 1, 0.7), expected[i]):
+                mismatches.append(i)
+
+    threads = [threading.Thread(target=job, args=(i,)) for i in range(len(inputs))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert mismatches == []
+    assert len(offload.buffers) <= 3
+
+
+def failing_patch(monkeypatch, error, backend):
+    def fail(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(patch, "Fourier_filter", fail)
+    params = patch.FUMPatchParams()
+    params.update(4, 1.1, 1.2, 0.8, 0.9, filter_backend=backend)
+    return patch.make_output_block_patch(params)
+
+
+@pytest.mark.parametrize("backend", ["fft", "lowband"])
+def test_filter_failure_falls_back_for_that_call_only(monkeypatch, backend):
+    output_block_patch = failing_patch(monkeypatch, RuntimeError("transient"), backend)
+    h = torch.randn(2, 16, 8, 8)
+    hsp = torch.randn(2, 16, 8, 8)
+    devices.supports_fft("cpu")
+
+    _, filtered = output_block_patch(h, hsp, {})
+
+    torch.testing.assert_close(filtered, spectral.filter_skip(hsp, 1, 0.8, backend))
+    assert devices.supports_fft("cpu")
+
+
+def test_filter_out_of_memory_is_raised(monkeypatch):
+    output_block_patch = failing_patch(monkeypatch, torch.cuda.OutOfMemoryError("out of memory"), "fft")
+    with pytest.raises(torch.cuda.OutOfMemoryError):
+        output_block_patch(torch.randn(1, 16, 8, 8), torch.randn(1, 16, 8, 8), {})
+    assert devices.supports_fft("cpu")
@@ -0,0 +1,168 @@
+import math
+import random
+
+import numpy as np
+import pytest
+
+from lib_fum import motion, sequence
+
+
+def config(preset, value=1.0, lower=0.5, upper=1.5, step=0.03, speed=1.0, cycle=60, phase=0.0):
+    return {"preset": preset, "value": value, "min": lower, "max": upper, "step": step, "speed": speed, "cycle": cycle, "phase": phase}
+
+
+def stepwise(cfg, frames, choice=None):
+    # The per-frame definition the motion table replaces: stateful presets carry their current
+    # value (and YoYo its direction) from one frame to the next.
+    lower, upper = cfg["min"], cfg["max"]
+    origin = min(upper, max(lower, cfg["value"]))
+    preset = cfg["preset"]
+    effective_step = max(0.0001, cfg["step"] * cfg["speed"])
+    current, direction = origin, 1
+    values = []
+    for frame in frames:
+        if preset == "Off" or upper <= lower:
+            values.append(origin)
+            continue
+        if preset == "Random Step":
+            current = min(upper, max(lower, current + choice([-effective_step, effective_step])))
+        elif preset == "Linear Up":
+            current = min(upper, max(lower, origin + effective_step * frame))
+        elif preset == "Linear Down":
+            current = min(upper, max(lower, origin - effective_step * frame))
+        elif preset == "YoYo":
+            current += direction * effective_step
+            if current >= upper:
+                current, direction = upper, -1
+            elif current <= lower:
+                current, direction = lower, 1
+        else:
+            t = ((frame * cfg["speed"]) / float(cfg["cycle"]) + cfg["phase"]) % 1.0
+            triangle = 1.0 - abs(2.0 * t - 1.0)
+            ease = 0.5 - 0.5 * math.cos(triangle * math.pi)
+            if preset == "Pulse Return":
+                target = upper if abs(upper - origin) >= abs(origin - lower) else lower
+                current = origin + (target - origin) * ease
+            else:
+                normalized = {
+                    "Wave": 0.5 + 0.5 * math.sin(2.0 * math.pi * t - math.pi / 2.0),
+                    "Triangle": triangle,
+                    "Saw Up": t,
+                    "Saw Down": 1.0 - t,
+                    "Ease In-Out": ease,
+                    "Square Hold": 1.0 if t < 0.5 else 0.0,
+                }[preset]
+                current = lower + (upper - lower) * normalized
+            current = min(upper, max(lower, current))
+        values.append(current)
+    return values
+
+
+def compile_column(cfg, count, frame_origin=0, frame_step=1, seed=1234, epoch=0, first_position=0):
+    configs = {name: cfg for name in motion.param_names}
+    epochs = {name: epoch for name in motion.param_names}
+    table = motion.compile_motion_table(configs, first_position, count, frame_origin, frame_step, epochs, seed)
+    return table[:, 0]
+
+
+deterministic_presets = [preset for preset in motion.motion_presets if preset != "Random Step"]
+
+yoyo_configs = [
+    config("YoYo"),
+    config("YoYo", value=1.5),
+    config("YoYo", value=0.5, step=0.1),
+    config("YoYo", value=0.72, lower=0.4, upper=1.9, step=0.07, speed=1.7),
+]
+
+
+@pytest.mark.parametrize("preset", deterministic_presets)
+@pytest.mark.parametrize("frame_origin, frame_step", [(0, 1), (5, 2)])
+def test_presets_match_stepwise_definition(preset, frame_origin, frame_step):
+    cfg = config(preset, value=0.8, speed=1.3, cycle=24, phase=0.2)
+    frames = [frame_origin + position * frame_step for position in range(200)]
+    expected = stepwise(cfg, frames)
+    np.testing.assert_allclose(compile_column(cfg, 200, frame_origin, frame_step), expected, rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize("cfg", yoyo_configs)
+def test_yoyo_reverses_like_stepwise_definition(cfg):
+    # Several full sweeps, so the closed form crosses both bounds more than once.
+    values = compile_column(cfg, 400)
+    np.testing.assert_allclose(values, stepwise(cfg, range(400)), rtol=0, atol=1e-6)
+    assert np.isclose(values, cfg["max"]).sum() > 2
+    assert np.isclose(values, cfg["min"]).sum() > 2
+
+
+def test_random_step_moves_like_stepwise_definition():
+    cfg = config("Random Step", value=1.45, step=0.05)
+    values = compile_column(cfg, 300)
+    # Every frame moves one step from the previous value (the first from the origin), clamped.
+    previous = np.concatenate(([cfg["value"]], values[:-1]))
+    up = np.minimum(previous + 0.05, cfg["max"])
+    down = np.maximum(previous - 0.05, cfg["min"])
+    assert np.all(np.isclose(values, up, atol=1e-6) | np.isclose(values, down, atol=1e-6))
+
+    signs = iter(np.where(np.isclose(values, up, atol=1e-6), 1, -1))
+    choice = lambda moves: moves[0] if next(signs) < 0 else moves[1]
+    np.testing.assert_allclose(values, stepwise(cfg, range(300), choice), rtol=0, atol=1e-6)
+
+
+def test_random_step_is_seeded():
+    cfg = config("Random Step")
+    first = compile_column(cfg, 100, seed=7, epoch=3)
+    assert np.array_equal(first, compile_column(cfg, 100, seed=7, epoch=3))
+    assert not np.array_equal(first, compile_column(cfg, 100, seed=8, epoch=3))
+    assert not np.array_equal(first, compile_column(cfg, 100, seed=7, epoch=4))
+
+    # The walk does not depend on the global random state.
+    random.seed(1)
+    np.random.seed(1)
+    assert np.array_equal(first, compile_column(cfg, 100, seed=7, epoch=3))
+
+
+def sequence_configs():
+    return {
+        "b1": config("Random Step", value=1.1),
+        "b2": config("YoYo", value=1.2, step=0.04),
+        "s1": config("Wave", lower=0.2, upper=1.0, cycle=37),
+        "s2": config("Pulse Return", value=0.6, lower=0.2, upper=1.0, cycle=50, phase=0.3),
+    }
+
+
+def render(state, configs, jobs, frame_count, start=3, frame_step=2):
+    values = []
+    for _ in range(jobs):
+        frame_index = start + state.position * frame_step
+        job = state.motion_values(configs, frame_index, frame_step, frame_count)
+        values += [[job[name][i] for name in motion.param_names] for i in range(frame_count)]
+        state.position += frame_count
+    return values
+
+
+def whole_sequence(seed, count, start=3, frame_step=2):
+    configs = sequence_configs()
+    epochs = {name: 0 for name in motion.param_names}
+    table = motion.compile_motion_table(configs, 0, count, start, frame_step, epochs, seed)
+    return np.round(table.astype(np.float64), 6).tolist()
+
+
+@pytest.mark.parametrize("frame_count", [1, 3, 7])
+def test_values_are_continuous_across_table_chunks(frame_count):
+    state = sequence.SequenceState("chunks")
+    state.reset_motion(99)
+    jobs = (3 * motion.table_chunk_frames) // frame_count + 1
+    values = render(state, sequence_configs(), jobs, frame_count)
+    assert values == whole_sequence(99, jobs * frame_count)
+
+
+def test_values_continue_after_checkpoint_restore():
+    configs = sequence_configs()
+    state = sequence.SequenceState("restore")
+    state.reset_motion(5)
+    before = render(state, configs, 100, 3)
+
+    restored = sequence.SequenceState("restore")
+    restored.restore_checkpoint(state.to_checkpoint())
+    after = render(restored, configs, 100, 3)
+
+    assert before + after == whole_sequence(5, 600)
@@ -0,0 +1,42 @@
+import torch
+
+from lib_fum import noise, prefix, sequence
+
+
+def record_noise(state, key, size):
+    state.noise_cache.record(key).append(torch.zeros(size, dtype=torch.uint8))
+
+
+def test_noise_cache_is_bounded_by_bytes():
+    cache = noise.NoiseCache(limit=8, limit_bytes=250)
+    for key in range(4):
+        cache.record(key).append(torch.zeros(100, dtype=torch.uint8))
+        cache.record(key)
+    assert list(cache.records) == [2, 3]
+    assert cache.nbytes() == 200
+
+
+def test_store_releases_least_recently_used_caches():
+    store = sequence.SequenceStateStore(limit=8, cache_limit=250)
+    for sequence_id in ("a", "b", "c"):
+        record_noise(store.get(sequence_id), sequence_id, 100)
+    store.get("c").prefix_snapshot = prefix.PrefixSnapshot("key", 2, 10, torch.zeros(40, dtype=torch.uint8), 1.0)
+
+    store.get("c")
+    assert store.get("a").cache_bytes() == 0
+    assert store.get("b").cache_bytes() == 100
+    assert store.get("c").cache_bytes() == 140
+
+
+def test_release_caches_keeps_the_motion_state():
+    store = sequence.SequenceStateStore()
+    state = store.get("api-1")
+    state.reset_motion(7)
+    state.position = 12
+    record_noise(state, "key", 16)
+
+    store.release_caches("api-1")
+    assert state.cache_bytes() == 0
+    assert state.prefix_snapshot is None
+    assert (state.position, state.motion_seed) == (12, 7)
+    assert store.get("api-1") is state
@@ -0,0 +1,95 @@
+import importlib.util
+import os
+
+import pytest
+import torch
+
+from lib_fum import spectral
+
+
+shapes = [(1, 4, 16, 16), (2, 3, 15, 17), (1, 2, 9, 8), (3, 2, 32, 24)]
+
+
+def sample(shape, dtype=torch.float32):
+    generator = torch.Generator().manual_seed(sum(shape))
+    return torch.randn(shape, generator=generator).to(dtype)
+
+
+def reference_per_sample(x, threshold, scales):
+    return torch.cat([spectral.fourier_filter_reference(x[i:i + 1], threshold, float(s)) for i, s in enumerate(scales)])
+
+
+@pytest.mark.parametrize("shape", shapes)
+@pytest.mark.parametrize("threshold", [1, 2, 5])
+@pytest.mark.parametrize("scale", [0.2, 0.9, 1.0, 1.7])
+def test_fourier_filter_matches_reference(shape, threshold, scale):
+    x = sample(shape)
+    expected = spectral.fourier_filter_reference(x, threshold, scale)
+    torch.testing.assert_close(spectral.fourier_filter(x, threshold, scale), expected, rtol=0, atol=1e-5)
+
+
+@pytest.mark.parametrize("shape", shapes)
+@pytest.mark.parametrize("threshold", [1, 2])
+@pytest.mark.parametrize("scale", [0.2, 1.0, 1.7])
+def test_lowband_filter_matches_reference(shape, threshold, scale):
+    x = sample(shape)
+    expected = spectral.fourier_filter_reference(x, threshold, scale)
+    torch.testing.assert_close(spectral.lowband_filter(x, threshold, scale), expected, rtol=0, atol=1e-4)
+
+
+@pytest.mark.parametrize("run", [spectral.fourier_filter, spectral.lowband_filter])
+def test_per_sample_scales_match_reference(run):
+    x = sample((3, 4, 15, 16))
+    scales = torch.tensor([0.5, 1.0, 1.4])
+    torch.testing.assert_close(run(x, 1, scales), reference_per_sample(x, 1, scales), rtol=0, atol=1e-4)
+
+
+def test_filter_plan_is_shared_between_scales():
+    spectral.clear_filter_cache()
+    x = sample((1, 2, 16, 16))
+    for scale in (0.3, 0.6, 0.9, 1.2):
+        spectral.fourier_filter(x, 2, scale)
+    assert len(spectral._plan_cache) == 1
+
+
+@pytest.mark.parametrize("backend", ["fft", "lowband"])
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float16])
+@pytest.mark.parametrize("shape", [(4, 6, 16, 16), (1, 7, 15, 17)])
+def test_chunked_filter_is_bit_identical(backend, dtype, shape):
+    x = sample(shape, dtype)
+    plane = shape[-2] * shape[-1] * spectral.filter_bytes_per_element[backend]
+    for budget in (2 * plane, 3 * plane, (shape[0] * shape[1] - 1) * plane):
+        assert spectral.filter_chunks(x, backend, budget) is not None
+        whole = spectral.filter_skip(x, 1, 0.8, backend)
+        chunked = spectral.filter_skip(x, 1, 0.8, backend, memory_budget=budget)
+        assert torch.equal(whole, chunked)
+
+
+def test_chunked_filter_with_per_sample_scales():
+    x = sample((4, 3, 16, 16))
+    scales = torch.tensor([0.5, 0.8, 1.0, 1.3])
+    plane = 16 * 16 * spectral.filter_bytes_per_element["fft"]
+    whole = spectral.filter_skip(x, 1, scales, "fft")
+    chunked = spectral.filter_skip(x, 1, scales, "fft", memory_budget=3 * plane)
+    assert torch.equal(whole, chunked)
+
+
+@pytest.fixture(scope="module")
+def benchmark():
+    # The benchmark's peak tracker counts the storages a call creates on the CPU.
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "extras", "fum_benchmark.py")
+    spec = importlib.util.spec_from_file_location("fum_benchmark", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.mark.parametrize("backend", ["fft", "lowband"])
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float16])
+@pytest.mark.parametrize("shape", [(2, 64, 16, 16), (2, 32, 32, 32), (1, 8, 64, 64), (3, 7, 15, 17)])
+def test_bytes_per_element_bound_the_measured_peak(benchmark, backend, dtype, shape):
+    run = spectral.lowband_filter if backend == "lowband" else spectral.fourier_filter
+    x = sample(shape, dtype)
+    run(x, 1, 0.8)
+    peak = benchmark.measure_peak(lambda: run(x, 1, 0.8), torch.device("cpu"), x)
+    assert peak <= x.numel() * spectral.filter_bytes_per_element[backend]